@@ -1,67 +1,83 @@
 # Defines geographic model features:
-# Defines a specified warehouse start point and generates a boounding box round it
+# Defines the warehouse start points and generates a bounding box round a warehouse's area
 # Defines functions to convert between British National Grid Eastings/Northings
 # and latitude/longitude, to find the geodisic distances between lat/long points,
 
-from scipy.spatial import Voronoi
-from pyproj import Proj, transform
-from math import *
+from functools import lru_cache
+import numpy as np
+from projections import bng2wgs
 
-# Specify warehouse (UUK2 = S, DXE1 = NE, DHA1 = NW)
+# default warehouse (UUK2 = S, DXE1 = NE, DHA1 = NW), used unless a Scenario specifies another
 warehouse = 'UUK2'
 
-# map expansion from start/end coordinates in m
+# default map expansion from start/end coordinates in m
 expNS = 500
 expEW = 500
 
 # closest warehouse locations to London (eastings, northings - British National Grid system)
 whCoords = {'UUK2': [525992, 169591], 'DXE1': [538278, 182093], 'DHA1': [520415, 185628]}
-print(whCoords['UUK2'])
-# furthest point from London's 3 central Amazon warehouses
-centreEN = Voronoi([whCoords['UUK2'], whCoords['DXE1'], whCoords['DHA1']]).vertices[0]
-
-# defines furthest start and end delivery points                         
-start = whCoords[warehouse]
-end = centreEN
-
-# coordinate system parameters
-v84 = Proj(proj="latlong",towgs84="0,0,0",ellps="WGS84")
-v36 = Proj(proj="latlong", k=0.9996012717, ellps="airy",
-        towgs84="446.448,-125.157,542.060,0.1502,0.2470,0.8421,-20.4894")
-vgrid = Proj(init="world:bng")
 
+@lru_cache(maxsize=None)
+def centreEN():
+    # furthest point from London's 3 central Amazon warehouses, used as the furthest
+    # delivery point of every warehouse's area
+    from scipy.spatial import Voronoi
+    return tuple(Voronoi([whCoords['UUK2'], whCoords['DXE1'], whCoords['DHA1']]).vertices[0])
 
 def EN2LL(EN):
-    # converts British National Grid coordinates to latitude and longitude
-    vlon36, vlat36 = vgrid(EN[0], 
-                           EN[1], 
-                           inverse=True)
-    converted = transform(v36, v84, vlon36, vlat36)
-    lon = converted[0]
-    lat = converted[1]
+    # converts British National Grid coordinates (scalars or arrays) to latitude and longitude
+    lat, lon = bng2wgs(EN[0], EN[1])
     return lat, lon
 
+# max memory (bytes) used by each block of a pairwise distance matrix
+maxBlockBytes = 64*2**20
+
 def haversine(lon1, lat1, lon2, lat2):
-    # implements Haversine formula to find the geodisic distances between points 
-    lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2]) 
+    # implements Haversine formula to find the geodisic distances between points,
+    # given as scalars or arrays (broadcast against each other)
+    lon1, lat1, lon2, lat2 = map(np.radians, [lon1, lat1, lon2, lat2])
     dlon = lon2 - lon1 
     dlat = lat2 - lat1 
-    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-    c = 2 * asin(sqrt(a)) 
+    a = np.sin(dlat/2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2)**2
+    c = 2 * np.arcsin(np.sqrt(np.minimum(a, 1)))
     r = 6371 # Radius of earth in kilometers. Use 3956 for miles. Determines return value units.
     return c * r
 
+def distanceBlocks(points1, points2, maxBytes=maxBlockBytes):
+    # yields (row slice, distances in km) blocks of the pairwise distance matrix between
+    # (n, 2) arrays of lat/lon points, with rows per block limited so that the block and
+    # its temporaries stay within maxBytes
+    points1, points2 = np.atleast_2d(points1).astype(float), np.atleast_2d(points2).astype(float)
+    lat2, lon2 = np.radians(points2[:,0]), np.radians(points2[:,1])
+    cosLat2 = np.cos(lat2)
+    nRows = max(1, int(maxBytes // (4*8*max(len(points2), 1))))
+    for i in range(0, len(points1), nRows):
+        rows = slice(i, min(i+nRows, len(points1)))
+        lat1, lon1 = np.radians(points1[rows,0])[:,None], np.radians(points1[rows,1])[:,None]
+        a = np.sin((lat2-lat1)/2)**2 + np.cos(lat1)*cosLat2*np.sin((lon2-lon1)/2)**2
+        yield rows, 2*6371*np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+def distanceMatrix(points1, points2, maxBytes=maxBlockBytes):
+    # returns the (n1, n2) matrix of distances in km between two sets of lat/lon points
+    out = np.empty((len(np.atleast_2d(points1)), len(np.atleast_2d(points2))))
+    for rows, block in distanceBlocks(points1, points2, maxBytes):
+        out[rows] = block
+    return out
+
+def nearestDistances(points1, points2, maxBytes=maxBlockBytes):
+    # returns the distance in km from each point in points1 to its nearest point in points2,
+    # without holding the full matrix, e.g. to prefilter destinations far from any bus stop
+    out = np.empty(len(np.atleast_2d(points1)))
+    for rows, block in distanceBlocks(points1, points2, maxBytes):
+        out[rows] = block.min(axis=1)
+    return out
+
 def getBounds(start, end, expNS, expEW):
     # returns unexpanded and expanded NESW bounds, based on start and end points
-    NE = EN2LL([max(start[0], end[0]),max(start[1],end[1])])
-    SW = EN2LL([min(start[0], end[0]),min(start[1],end[1])])
-    bounds = NE+SW
-    exNE = EN2LL([max(start[0], end[0])+expNS,max(start[1],end[1])+expEW])
-    exSW = EN2LL([min(start[0], end[0])-expNS,min(start[1],end[1])-expEW])
-    expanded = exNE+exSW
+    # converting all four corners in one call
+    maxE, maxN = max(start[0], end[0]), max(start[1], end[1])
+    minE, minN = min(start[0], end[0]), min(start[1], end[1])
+    lats, lons = bng2wgs([maxE, minE, maxE+expNS, minE-expNS], [maxN, minN, maxN+expEW, minN-expEW])
+    bounds = (float(lats[0]), float(lons[0]), float(lats[1]), float(lons[1]))
+    expanded = (float(lats[2]), float(lons[2]), float(lats[3]), float(lons[3]))
     return[bounds, expanded]
-
-# bounding box values 
-bBoxes = getBounds(start, end, expNS, expEW)
-startLL = EN2LL(start)
-
@@ -0,0 +1,49 @@
+# Benchmarks the graph cleaning stage of generateGraphs on synthetic street grids of
+# increasing size, as an osmnx area grows with the map expansion (expNS/expEW).
+# Each grid has two-way streets with roughly 1 in 10 node pairs joined by parallel edges,
+# so the time per edge should stay constant as the grid grows.
+#   python benchGraphs.py [grid sizes...]
+
+import sys
+import time
+import random
+import networkx as nx
+import generateGraphs as gG
+
+def gridGraph(n, parallelFrac=0.1, seed=0):
+    # builds an n*n osmnx-style street grid, with some parallel edges (up to 3 per pair)
+    rnd = random.Random(seed)
+    P = nx.MultiDiGraph(crs='epsg:4326')
+    step = 0.002
+    P.add_nodes_from((i*n+j, {'x': -0.2+j*step, 'y': 51.4+i*step}) for i in range(n) for j in range(n))
+    edges = []
+    for i in range(n):
+        for j in range(n):
+            a = i*n+j
+            for b in ((a+1) if j+1 < n else None, (a+n) if i+1 < n else None):
+                if b is None:
+                    continue
+                length = rnd.uniform(100, 250)
+                copies = rnd.choice((2, 3)) if rnd.random() < parallelFrac else 1
+                for k in range(copies):
+                    edges += [(a, b, {'length': length+10*k}), (b, a, {'length': length+10*k})]
+    P.add_edges_from(edges)
+    return P
+
+def benchClean(n, repeats=3):
+    # returns the best time (s) to clean an n*n grid, and its number of edges
+    best = float('inf')
+    for _ in range(repeats):
+        P = gridGraph(n)
+        nEdges = P.number_of_edges()
+        t = time.perf_counter()
+        gG.cleanGraph(P)
+        best = min(best, time.perf_counter()-t)
+    return best, nEdges
+
+if __name__ == '__main__':
+    sizes = [int(a) for a in sys.argv[1:]] or [50, 100, 200, 400]
+    print('grid    edges     time (s)   us/edge')
+    for n in sizes:
+        t, nEdges = benchClean(n)
+        print(f'{n:4d} {nEdges:9d} {t:12.3f} {1e6*t/nEdges:9.2f}')
@@ -1,41 +1,182 @@
 # Defines the account details and functions used to access TFL API data
+# Requests share a pooled session, are limited to a maximum request rate, and are
+# retried with exponential backoff, so many stops and lines can be fetched concurrently
+# Responses are kept in a persistent on-disk cache, so repeat lookups need no request
 import requests
 import json
+import threading
+import time
+import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import busStops
 
 # TFL API account details
 appID = 'a0bf554f7d134cd9a0467899c3a05d28'
 appKey = '4692650cbf574584b1773043f1e22500'
 
-# gets list of lines stopping at a specified stop
-def fetchLines(stopID):
-    response = requests.get(f"https://api.tfl.gov.uk/StopPoint/{stopID}?app_id={appID}&app_key={appKey}")
+# client settings (apiRoot can point at a local stub server for testing)
+apiRoot = 'https://api.tfl.gov.uk'
+maxRate = 8                 # max requests per second, across all threads
+nWorkers = 8                # concurrent requests
+retries = 4                 # retries of failed requests
+backoff = 0.5               # initial retry wait in s, doubled on each retry
+timeout = 30                # request timeout in s
+retryStatus = (429, 500, 502, 503, 504)
 
-    if response.status_code != 200:
-        raise RuntimeError('Failed request')
-    else:
-        lines = json.loads(response.text)['lines']
-        return(lines)
+# response cache settings: entries expire after cacheTTL s, the least recently used are
+# evicted above cacheMaxBytes, and offline mode serves only (possibly expired) cached data
+useCache = True
+offline = False
+cacheDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'tfl')
+cacheTTL = 30*24*3600
+cacheMaxBytes = 200*2**20
 
-# gets list of stops on a specified line
-def fetchStops(lineID):
-    stopData = []
-    stations = requests.get(f"https://api.tfl.gov.uk/Line/{lineID}/Route/Sequence/inbound?app_id={appID}&app_key={appKey}")
-
-    if stations.status_code != 200:
-        raise RuntimeError('Failed request')
-    else:
-        data = (stations.json())
-        stops = [data['orderedLineRoutes'][0]['naptanIds']]
-        for s in stops[0]:
-            response = requests.get(f"https://api.tfl.gov.uk/StopPoint/{s}?app_id={appID}&app_key={appKey}")
-            if response.status_code != 200:
-                raise RuntimeError('Failed request')
-            else:
-                data = response.json()
-                lon = float(data['lon'])
-                lat = float(data['lat'])
-                stopData.append([s,lon,lat])
-        return(stopData)
+session = None
+sessionLock = threading.Lock()
+rateLock = threading.Lock()
+nextSlot = 0.0
+cacheLock = threading.Lock()
+cacheBytes = None
+
+def getSession():
+    # returns the shared session, with a connection pool sized for the worker threads
+    global session
+    with sessionLock:
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=nWorkers, pool_maxsize=nWorkers)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        return session
+
+def waitForSlot():
+    # blocks until the next request is allowed under the maximum request rate
+    global nextSlot
+    with rateLock:
+        now = time.monotonic()
+        wait = nextSlot - now
+        nextSlot = max(now, nextSlot) + 1/maxRate
+    if wait > 0:
+        time.sleep(wait)
+
+def cachePath(path):
+    # returns the cache file for an API path, named by the hash of the endpoint and ID
+    return os.path.join(cacheDir, hashlib.sha1(path.encode()).hexdigest() + '.json')
+
+def cacheGet(path):
+    # returns the cached response data for an API path, or None if missing or expired
+    fName = cachePath(path)
+    try:
+        with open(fName, encoding='utf-8') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if entry['path'] != path or (not offline and time.time()-entry['time'] > cacheTTL):
+        return None
+    # marks the entry as recently used for eviction
+    try:
+        os.utime(fName)
+    except OSError:
+        pass
+    return entry['data']
+
+def cachePut(path, data):
+    # writes response data to the cache, evicting least recently used entries if over size
+    global cacheBytes
+    os.makedirs(cacheDir, exist_ok=True)
+    fName = cachePath(path)
+    tmpName = f"{fName}.{threading.get_ident()}.tmp"
+    with open(tmpName, 'w', encoding='utf-8') as f:
+        json.dump({'path': path, 'time': time.time(), 'data': data}, f)
+    os.replace(tmpName, fName)
+    with cacheLock:
+        if cacheBytes is None:
+            cacheBytes = sum(e.stat().st_size for e in os.scandir(cacheDir) if e.name.endswith('.json'))
+        else:
+            cacheBytes += os.path.getsize(fName)
+        if cacheBytes > cacheMaxBytes:
+            entries = sorted((e for e in os.scandir(cacheDir) if e.name.endswith('.json')),
+                             key=lambda e: e.stat().st_mtime)
+            cacheBytes = sum(e.stat().st_size for e in entries)
+            for e in entries:
+                if cacheBytes <= 0.9*cacheMaxBytes:
+                    break
+                cacheBytes -= e.stat().st_size
+                os.remove(e.path)
 
+def clearCache():
+    # deletes all cached responses
+    global cacheBytes
+    with cacheLock:
+        if os.path.isdir(cacheDir):
+            for e in os.scandir(cacheDir):
+                if e.name.endswith('.json'):
+                    os.remove(e.path)
+        cacheBytes = None
 
+def apiGet(path):
+    # returns the response data for a TFL API path, from the cache if available, otherwise
+    # from a rate limited GET request, retrying rate limited, server error, connection
+    # and timeout failures with backoff
+    if useCache or offline:
+        data = cacheGet(path)
+        if data is not None:
+            return data
+        if offline:
+            raise RuntimeError('Failed request: not cached in offline mode')
+    data = apiRequest(path)
+    if useCache:
+        cachePut(path, data)
+    return data
 
+def apiRequest(path):
+    # makes a rate limited GET request to the TFL API and returns the response data
+    for attempt in range(retries+1):
+        waitForSlot()
+        try:
+            response = getSession().get(apiRoot+path, params={'app_id': appID, 'app_key': appKey}, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout):
+            response = None
+        if response is not None and response.status_code == 200:
+            return json.loads(response.text)
+        if attempt == retries or (response is not None and response.status_code not in retryStatus):
+            raise RuntimeError('Failed request')
+        wait = backoff*2**attempt
+        if response is not None and response.headers.get('Retry-After', '').isdigit():
+            wait = max(wait, int(response.headers['Retry-After']))
+        time.sleep(wait)
+
+def fetchMany(fetch, ids, returnErrors=False):
+    # calls a fetch function for each id concurrently, returning results in the order of ids
+    # if returnErrors, failed fetches return their exception instead of raising it
+    def call(i):
+        try:
+            return fetch(i)
+        except Exception as e:
+            if returnErrors:
+                return e
+            raise
+    with ThreadPoolExecutor(nWorkers) as pool:
+        return list(pool.map(call, ids))
+
+# gets list of lines stopping at a specified stop
+def fetchLines(stopID):
+    lines = apiGet(f"/StopPoint/{stopID}")['lines']
+    return(lines)
+
+# gets the longitude and latitude of a specified stop
+def fetchStopLL(stopID):
+    data = apiGet(f"/StopPoint/{stopID}")
+    return [stopID, float(data['lon']), float(data['lat'])]
+
+# gets list of stops on a specified line, locating stops from the local stop index
+# and only calling the API for stops missing from it
+def fetchStops(lineID):
+    data = apiGet(f"/Line/{lineID}/Route/Sequence/inbound")
+    stops = data['orderedLineRoutes'][0]['naptanIds']
+    index = busStops.getStopIndex()
+    missing = [s for s in stops if s not in index]
+    fetched = dict(zip(missing, fetchMany(fetchStopLL, missing)))
+    stopData = [[s, index[s][1], index[s][0]] if s in index else fetched[s] for s in stops]
+    return(stopData)
@@ -0,0 +1,58 @@
+# Defines a local index of London bus stops, built once from 'busData/busStops.csv'.
+# Stop coordinates are converted from Eastings/Northings to latitude/longitude in bulk,
+# so the stops on a line can be located without a TFL API call per stop.
+
+import os
+import numpy as np
+import pandas as pd
+from projections import bng2wgs
+
+stopsFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'busData', 'busStops.csv')
+
+# stop table and NaPTAN ID -> (lat, lon) index, loaded on first use
+stopTable = None
+stopIndex = None
+
+def loadStops():
+    # returns the stop table as arrays of NaPTAN IDs, latitudes and longitudes,
+    # skipping stops without an ID or location
+    global stopTable
+    if stopTable is None:
+        allStops = pd.read_csv(stopsFile)
+        allStops = allStops.dropna(subset=['Naptan_Atco', 'Location_Easting', 'Location_Northing'])
+        lats, lons = bng2wgs(allStops['Location_Easting'].to_numpy(), allStops['Location_Northing'].to_numpy())
+        stopTable = (allStops['Naptan_Atco'].to_numpy(dtype=str), np.asarray(lats), np.asarray(lons))
+    return stopTable
+
+def getStopIndex():
+    # returns the dict mapping each NaPTAN ID to its (lat, lon), keeping the first entry of duplicates
+    global stopIndex
+    if stopIndex is None:
+        ids, lats, lons = loadStops()
+        index = {}
+        for i, lat, lon in zip(ids.tolist(), lats.tolist(), lons.tolist()):
+            index.setdefault(i, (lat, lon))
+        stopIndex = index
+    return stopIndex
+
+def boundsMask(lats, lons, bounds):
+    # returns a boolean mask of the points strictly within the N,E,S,W bounds
+    N,E,S,W = bounds
+    return (lats > S) & (lats < N) & (lons > W) & (lons < E)
+
+def selectStops(bounds, idCode='900'):
+    # returns the IDs, latitudes and longitudes of all stops within the bounds whose ID
+    # contains idCode (the bus stop code), selected with one mask over the stop table
+    ids, lats, lons = loadStops()
+    mask = boundsMask(lats, lons, bounds)
+    if idCode:
+        mask &= np.char.find(ids, idCode) >= 0
+    return ids[mask], lats[mask], lons[mask]
+
+def filterLineStops(stopData, bounds):
+    # keeps the [ID, lon, lat] stops of a line that are within the bounds, in line order
+    if len(stopData) == 0:
+        return list(stopData)
+    coords = np.array([s[1:3] for s in stopData], dtype=float)
+    mask = boundsMask(coords[:,1], coords[:,0], bounds)
+    return [s for s, keep in zip(stopData, mask) if keep]
@@ -0,0 +1,91 @@
+# Checks the NumPy battery sizing of energyModels.battMassSolve against the original
+# sympy solution, on random routes covering no charging, charging with each charge stage
+# capacity- or charge-limited, and routes too long for any battery (which sympy can't
+# solve, and battMassSolve returns as NaN). Sympy takes about a second per route.
+#   python checkBattSolve.py [number of routes]
+
+import sys
+import math
+import numpy as np
+import energyModels as EM
+
+def sympySolve(lenF1, lenR, lenF2, payloadMass, charge=False):
+    # the original sympy battery sizing of battDistOptP, returning (battery mass, capacity,
+    # flight energy, charge on each bus ride, full charge on each ride), or None if sympy
+    # finds no real solution
+    import sympy as sp
+    battMass = sp.symbols('battMass')
+    tMass = EM.baseMass + payloadMass + battMass
+    eMass = EM.baseMass + battMass
+    if charge:
+        tMass += EM.WPTmass
+        eMass += EM.WPTmass
+    fullW = 4*(EM.thrustA*(tMass/4)**2 + EM.thrustB*(tMass/4))
+    emptyW = 4*(EM.thrustA*(eMass/4)**2 + EM.thrustB*(eMass/4))
+    oWayFlT1 = ((lenF1+EM.penalty)/EM.cruiseSpeed)/3600
+    oWayFlT2 = 0
+    if lenR != 0:
+        oWayFlT2 = ((lenF2+EM.penalty)/EM.cruiseSpeed)/3600
+    energyF1 = oWayFlT1*(fullW+EM.miscW)
+    energyF2 = oWayFlT2*(fullW+EM.miscW)
+    energyR1 = oWayFlT1*(emptyW+EM.miscW)
+    energyR2 = oWayFlT2*(emptyW+EM.miscW)
+    energyT = energyF1+energyF2+energyR1+energyR2
+    energyN = energyT + EM.battST*(fullW+EM.miscW)
+    chargeFull1 = chargeFull2 = 0
+    chAct1 = chAct2 = 0
+    try:
+        if charge and lenR > 0:
+            oWMaxCh = {'low': EM.actChargeRate, 'high': EM.thChargeRate}[charge]*(lenR/1000)/EM.busSpeed
+            ch1 = sp.Piecewise((energyF1, energyF1<oWMaxCh), (oWMaxCh, True))
+            ch2 = sp.Piecewise((energyF2+energyR2, energyF2+energyR2<oWMaxCh), (oWMaxCh, True))
+            actBattMass = sp.solve(battMass - ((energyN-ch1-ch2)/EM.safeDischarge)/EM.battED, battMass)[0]
+            chAct1 = ch1.subs(battMass, actBattMass)
+            chAct2 = ch2.subs(battMass, actBattMass)
+            if chAct1 < oWMaxCh:
+                chargeFull1 = 1
+            if chAct2 < oWMaxCh:
+                chargeFull2 = 1
+        else:
+            minBattMass = sp.solve(battMass - (energyN/EM.safeDischarge)/EM.battED, battMass)[0]
+            actBattMass = math.ceil(minBattMass/EM.bMStep)*EM.bMStep
+    except (TypeError, IndexError):
+        # complex roots (TypeError) or no solution (IndexError)
+        return None
+    return (float(actBattMass), float(actBattMass*EM.battED), float(energyT.subs(battMass, actBattMass)),
+            float(chAct1), float(chAct2), chargeFull1, chargeFull2)
+
+def randomRoutes(n, seed=0):
+    # returns n random (lenF1, lenR, lenF2, payload, charge) routes, some too long to fly
+    rnd = np.random.default_rng(seed)
+    routes = []
+    for i in range(n):
+        lenR = 0 if i % 4 == 0 else rnd.uniform(500, 15000)
+        lenF1 = rnd.uniform(0, 14000 if i % 10 == 0 else 6000)
+        lenF2 = 0 if lenR == 0 else rnd.uniform(0, 4000)
+        routes.append((lenF1, lenR, lenF2, int(rnd.integers(0, 2500)), [False, 'low', 'high'][i % 3]))
+    return routes
+
+def compare(routes):
+    # returns the largest relative difference between the two solvers, and the numbers of
+    # routes solved and unsolved, raising if they disagree on which routes are solvable
+    lenF1, lenR, lenF2, payloads, charges = zip(*routes)
+    chRates = [{'low': EM.actChargeRate, 'high': EM.thChargeRate}[c] if c else 0 for c in charges]
+    solved = EM.battMassSolve(lenF1, lenR, lenF2, payloads, chRates, [bool(c) for c in charges])
+    maxErr, nSolved = 0, 0
+    for i, route in enumerate(routes):
+        ref = sympySolve(*route)
+        new = [x[i] for x in solved]
+        if ref is None or np.isnan(new[0]):
+            if not (ref is None and np.isnan(new[0])):
+                raise AssertionError(f'Route {route}: sympy {ref}, NumPy {new}')
+            continue
+        nSolved += 1
+        for a, b in zip(ref, new):
+            maxErr = max(maxErr, abs(a-b)/max(abs(a), 1e-9))
+    return maxErr, nSolved, len(routes)-nSolved
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    maxErr, nSolved, nUnsolved = compare(randomRoutes(n))
+    print(f'{nSolved} routes solved, {nUnsolved} unsolvable, max relative difference {maxErr:.2e}')
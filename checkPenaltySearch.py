@@ -0,0 +1,71 @@
+# Checks the route engine's penalty weight searches (routeEngine.penaltyWeight), with both
+# backends, against a brute-force networkx search over (node, mode) states built from the
+# edge attributes, on a synthetic grid with bus lines. Each route's path is also re-costed
+# edge by edge, with the penalty added for each bus leg boarded.
+#   python checkPenaltySearch.py [grid size]
+
+import sys
+import numpy as np
+import networkx as nx
+import routeEngine as rE
+import routeFuncs as rF
+from checkStoredGraph import gridGraph
+
+def bruteForce(P, source, penalty, multiLeg):
+    # returns the lowest cost of reaching each node from source, boarding a bus adding
+    # penalty, with one bus leg unless multiLeg (modes: 0 not boarded, 1 riding, 2 alighted)
+    S = nx.DiGraph()
+    for u, v, d in P.edges(data=True):
+        if d['method'] == 'ride':
+            moves = [(0, 1, penalty), (1, 1, 0)] + ([(2, 1, penalty)] if multiLeg else [])
+        else:
+            moves = [(0, 0, 0), (1, 2, 0), (2, 2, 0)]
+        for a, b, pen in moves:
+            w = d['cost'] + pen
+            if not S.has_edge((u, a), (v, b)) or S[(u, a)][(v, b)]['w'] > w:
+                S.add_edge((u, a), (v, b), w=w)
+    best = {}
+    for (n, _), dist in nx.single_source_dijkstra_path_length(S, (source, 0), weight='w').items():
+        best[n] = min(best.get(n, np.inf), dist)
+    return best
+
+def pathCost(P, path):
+    # returns the cost, bus legs boarded and length ridden along a path
+    cost, legs, lenR, riding = 0, 0, 0, False
+    for u, v in zip(path, path[1:]):
+        edge = min(P[u][v].values(), key=lambda d: d['cost'])
+        cost += edge['cost']
+        if edge['method'] == 'ride':
+            legs += not riding
+            lenR += edge['length']
+        riding = edge['method'] == 'ride'
+    return cost, legs, lenR
+
+def compare(n):
+    # returns the largest difference from the brute-force costs, and the number of routes
+    # checked, raising if a route's path doesn't give its cost and ride length
+    P = rE.networkxGraph(rF.weightGraph(gridGraph(n), 0.02, 1, 25))
+    source = next(iter(P.nodes()))
+    maxErr, nRoutes = 0, 0
+    for penalty in (0, 0.5, 1.1, 3):
+        for multiLeg in (True, False):
+            ref = bruteForce(P, source, penalty, multiLeg)
+            weight = rE.penaltyWeight('cost', penalty, multiLeg)
+            for backend in ('networkx', 'scipy'):
+                rE.setBackend(backend)
+                rE.clearTrees()
+                for end in P.nodes():
+                    path, dist, totals = rE.route(P, source, end, weight)
+                    cost, legs, lenR = pathCost(P, path)
+                    if abs(cost + penalty*legs - dist) > 1e-9 or abs(lenR - totals[1]) > 1e-6 or (legs > 1 and not multiLeg):
+                        raise AssertionError(f'Route to {end} ({backend}, penalty {penalty}): {dist}, path {cost}, {legs} legs')
+                    maxErr = max(maxErr, abs(dist - ref[end]))
+                    nRoutes += 1
+    return maxErr, nRoutes
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    maxErr, nRoutes = compare(n)
+    print(f'{nRoutes} routes checked, max difference from brute force {maxErr:.2e}')
+    if maxErr > 1e-9:
+        raise AssertionError('Penalty weight routes differ from the brute-force search')
@@ -0,0 +1,81 @@
+# Checks that graphs loaded from their saved arrays (graphStore.StoredGraph) route the
+# same as the networkx graphs they were saved from, with both route engine backends, on a
+# synthetic grid with bus lines re-weighted for several energy ratios and cost factors.
+#   python checkStoredGraph.py [grid size]
+
+import sys
+import random
+import numpy as np
+import networkx as nx
+import graphStore as gS
+import routeEngine as rE
+import routeFuncs as rF
+
+def gridGraph(n, seed=0, lat0=51.41, lon0=-0.19, step=0.003):
+    # returns an osmnx-style n x n grid graph of two-way flight edges, with some rows and
+    # columns marked as bus lines
+    rnd = random.Random(seed)
+    P = nx.MultiDiGraph(crs='epsg:4326')
+    node = lambda i, j: 1000 + i*n + j
+    for i in range(n):
+        for j in range(n):
+            y, x = lat0 + i*step + rnd.uniform(-5e-4, 5e-4), lon0 + j*step + rnd.uniform(-5e-4, 5e-4)
+            P.add_node(node(i, j), x=x, y=y, lat=y, lon=x)
+    for i in range(n):
+        for j in range(n):
+            for a, b in (((i, j), (i, j+1)), ((i, j), (i+1, j))):
+                if b[0] < n and b[1] < n:
+                    length = rnd.uniform(150, 260)
+                    for u, v in ((node(*a), node(*b)), (node(*b), node(*a))):
+                        P.add_edge(u, v, length=length, method='fly', energy=length, cost=length, oneway=False)
+    for line in range(max(1, n//5)):
+        i, j = rnd.randrange(n), rnd.randrange(n)
+        for k in range(n-1):
+            for a, b in ((node(i, k), node(i, k+1)), (node(k, j), node(k+1, j))):
+                P[a][b][0]['method'] = P[b][a][0]['method'] = 'ride'
+    return P
+
+def routes(graph, starts, ends, busWhkm, flWhkm, cost):
+    # returns the (energy, km ridden, km flown) of the minimum energy routes, and the
+    # distances and totals of the cost-weighted routes, on a graph and its flight layer
+    rF.weightGraph(graph, busWhkm, flWhkm, cost)
+    flight = rE.flightLayer(graph)
+    out = []
+    for start in starts:
+        startN = rE.originNode(graph, start)
+        for end in ends:
+            out.extend(rF.minEnergyRoute(graph, start, end, 15, 36)[1:4])
+            for g in (graph, flight):
+                for weight in ('energy', 'cost', rE.costWeight(cost, busWhkm, flWhkm)):
+                    _, dist, totals = rE.route(g, startN, end, weight)
+                    out.extend((dist,) + tuple(totals[:5]))
+    return np.array(out, dtype=float)
+
+def compare(n):
+    # returns the largest relative difference between the routes on the networkx and
+    # stored graphs over both backends, and the number of routes compared
+    P = gridGraph(n)
+    nodes = list(P.nodes())
+    rnd = random.Random(1)
+    starts = [(P.nodes[s]['lat'], P.nodes[s]['lon']) for s in rnd.sample(nodes, 3)]
+    ends = rnd.sample(nodes, 20)
+    maxErr, nRoutes = 0, 0
+    for params in ((0.02, 1, 25), (0.72, 24, 1), (0.72, 24, 12)):
+        ref = None
+        for backend in ('networkx', 'scipy'):
+            rE.setBackend(backend)
+            for graph in (P, gS.StoredGraph(gS.graphArrays(P))):
+                res = routes(graph, starts, ends, *params)
+                if ref is None:
+                    ref = res
+                    continue
+                maxErr = max(maxErr, np.max(np.abs(res-ref)/np.maximum(np.abs(ref), 1e-9)))
+                nRoutes += len(starts)*len(ends)
+    return maxErr, nRoutes
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    maxErr, nRoutes = compare(n)
+    print(f'{nRoutes} routes compared, max relative difference {maxErr:.2e}')
+    if maxErr > 1e-9:
+        raise AssertionError('Stored graph routes differ from the networkx graph routes')
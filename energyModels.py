@@ -3,14 +3,10 @@
 # data on the minimum energy path, including lengths of path stages, optimal battery size, energy
 # consumption and charging power received.
 
-import sympy as sp
-import matplotlib.pyplot as plt
 import numpy as np
-import math
-import networkx as nx
-import osmnx as ox
 from areaDef import haversine
-import routeFuncs as rF
+import routeEngine as rE
+import spatialIndex as sI
 
 # Fixed parameters
 # all masses in g
@@ -42,137 +38,129 @@ penalty = 1100
 cruiseSpeed = 12            # drone cruise speed m/s - used to calculate flight time             
 busSpeed = 15               # km/hr, from https://www.london.gov.uk/who-we-are/what-london-assembly-does/questions-mayor/find-an-answer/average-bus-speeds 
 
-def findPathLengths(graph, start, end):
-    # Finds the lowest energy route between the start and end points by 
-    # comparing the energy consumption with and without the ride option
+def findPathLengths(graph, start, end, endN=None):
+    # Finds the lowest energy route between the start and end points, searching
+    # over the travel modes so that the take-off/landing penalty is charged when
+    # the drone boards a bus: routes only ride where this saves more than the
+    # penalty. Routes use at most one bus, the single ride battMassSolve models
+    # endN can pass the end point's nearest node if it is already known
 
     # finds nearest graph nodes to start and end points
-    start = ox.nearest_nodes(graph, start[1], start[0])
-    end = ox.nearest_nodes(graph, end[1], end[0])
-    path = nx.shortest_path(graph, start, end, weight='cost')  
-    pathFLen = nx.shortest_path_length(graph, start, end, weight='length')
-
-    # iterates through ride path to find path length of the 3 parts:
-    # pre-bus flight, bus-riding and post-bus flight
-    lenF1, lenR, enR, lenF2 = 0,0,0,0 
-    preR = True
-    for i in range(len(path)-1):
-        u, v = path[i], path[i+1]
-        edgeLen = graph[u][v][0]['length']
-        method = graph[u][v][0]['method']
-        if method == 'fly':
-            if preR == True:
-                lenF1 += edgeLen
-            else:
-                lenF2 += edgeLen
-        else:
-            preR = False
-            edgeLen = graph[u][v][0]['length']
-            # finds ride energy metric (length = energy metric for flight edges) 
-            edgeEn = graph[u][v][0]['energy']
-            lenR += edgeLen
-            enR += edgeEn
-
-    # uses TOL penalty to check if flight-only is more efficient, and updates lengths if so  
-    if pathFLen-(lenF1+enR+lenF2) < penalty:
-        lenF1=pathFLen
-        lenR = 0
-        lenF2 = 0
+    start = rE.originNode(graph, start)
+    end = sI.snapNode(graph, end) if endN is None else endN
+    # reads the route from the cached tree of the start node, with the penalty
+    # converted from a flight distance to the graph's cost units
+    weight = rE.penaltyWeight('cost', penalty*rE.flightWeight(graph), multiLeg=False)
+
+    # path length of the 3 parts: pre-bus flight, bus-riding and post-bus flight
+    _, _, (lenF1, lenR, _, lenF2, _) = rE.route(graph, start, end, weight)
 
     return lenF1, lenR, lenF2, end
 
 
-def battDistOptP(graph, start, end, payloadMass, charge=False):
+def battMassSolve(lenF1, lenR, lenF2, payloadMass, chRate=0, useWPT=False):
+    # Solves for the minimum battery mass of arrays of routes, given path stage lengths (m),
+    # payload masses, charge rates (W, 0 if no charging) and whether the WPT system is carried.
+    # Hover power is quadratic in battery mass, so battMass = battCap/battED is a quadratic
+    # in battery mass for each combination of the charge-limited or capacity-limited charge
+    # stages, and the smallest real root consistent with its combination is taken.
+    # Returns battery mass, capacity, flight energy, charge received on each bus ride
+    # and whether the battery reached full charge on each ride, with NaN values for
+    # routes no battery size can complete (no valid real root).
+    lenF1, lenR, lenF2, payloadMass, chRate, useWPT = np.broadcast_arrays(
+        *[np.atleast_1d(np.asarray(a, dtype=float)) for a in (lenF1, lenR, lenF2, payloadMass, chRate, useWPT)])
+
+    # masses at zero battery mass, with WPT onboard mass added where used
+    tMass0 = baseMass + payloadMass + WPTmass*useWPT
+    eMass0 = baseMass + WPTmass*useWPT
+    # coefficients (battMass^2, battMass, 1) of the power used with and w/out payload
+    fullW = np.stack([np.full_like(tMass0, thrustA/4), thrustA*tMass0/2 + thrustB,
+                      thrustA*tMass0**2/4 + thrustB*tMass0 + miscW])
+    emptyW = np.stack([np.full_like(eMass0, thrustA/4), thrustA*eMass0/2 + thrustB,
+                       thrustA*eMass0**2/4 + thrustB*eMass0 + miscW])
+
+    # one-way flight times per section, the second only if a bus is used
+    oWayFlT1 = ((lenF1+penalty)/cruiseSpeed)/3600
+    oWayFlT2 = np.where(lenR != 0, ((lenF2+penalty)/cruiseSpeed)/3600, 0)
+
+    # flight energy consumption coefficients on forward and return
+    energyF1 = oWayFlT1*fullW
+    energyF2 = oWayFlT2*fullW
+    energyR1 = oWayFlT1*emptyW
+    energyR2 = oWayFlT2*emptyW
+    energyT = energyF1+energyF2+energyR1+energyR2
+    energyN = energyT + battST*fullW
+
+    # max one-way charge; zero where charging is not available, so both charge stages are 0
+    charging = (chRate > 0) & (lenR > 0)
+    oWMaxCh = np.where(charging, chRate*(lenR/1000)/busSpeed, 0)
+    maxCh = np.stack([np.zeros_like(oWMaxCh), np.zeros_like(oWMaxCh), oWMaxCh])
+
+    def evaluate(coeffs, mass):
+        return coeffs[0]*mass**2 + coeffs[1]*mass + coeffs[2]
+
+    minBattMass = np.full_like(lenF1, np.inf)
+    for ch1 in (energyF1, maxCh):
+        for ch2 in (energyF2+energyR2, maxCh):
+            # battMass - (energyN-ch1-ch2)/(safeDischarge*battED) = 0
+            q = -(energyN-ch1-ch2)/(safeDischarge*battED)
+            q[1] += 1
+            disc = q[1]**2 - 4*q[0]*q[2]
+            sqrtDisc = np.sqrt(np.where(disc >= 0, disc, np.nan))
+            for root in ((-q[1]+sqrtDisc)/(2*q[0]), (-q[1]-sqrtDisc)/(2*q[0])):
+                # keeps roots for which the charge stages take the assumed branch
+                valid = ~np.isnan(root)
+                valid &= (evaluate(energyF1, root) < oWMaxCh) == (ch1 is energyF1)
+                valid &= (evaluate(energyF2+energyR2, root) < oWMaxCh) == (ch2 is not maxCh)
+                minBattMass = np.where(valid & (root < minBattMass), root, minBattMass)
+
+    # marks routes without a solution, then rounds battery mass up to the nearest
+    # available battery size if charging not used
+    minBattMass[np.isinf(minBattMass)] = np.nan
+    actBattMass = np.where(charging, minBattMass, np.ceil(minBattMass/bMStep)*bMStep)
+
+    # charge received on each bus ride, and whether the battery reached full capacity
+    chAct1 = np.where(charging, np.minimum(evaluate(energyF1, actBattMass), oWMaxCh), 0)
+    chAct2 = np.where(charging, np.minimum(evaluate(energyF2+energyR2, actBattMass), oWMaxCh), 0)
+    chargeFull1 = (charging & (chAct1 < oWMaxCh)).astype(int)
+    chargeFull2 = (charging & (chAct2 < oWMaxCh)).astype(int)
+
+    battCap = actBattMass*battED
+    energyT = evaluate(energyT, actBattMass)
+    return actBattMass, battCap, energyT, chAct1, chAct2, chargeFull1, chargeFull2
+
+
+def battDistOptP(graph, start, end, payloadMass, charge=False, lengths=None):
     # Finds the lowest energy graph route between a start and end point, 
     # and determines the minimum battery size for that route, accounting 
     # for the relationship between battery mass and energy consumption, 
     # and power received from wireless charging at the specified charge rate.
+    # lengths can pass the route's findPathLengths output if already known
 
     # finds length of flight and ride sections for lowest energy route
-    lenF1, lenR, lenF2, endN = findPathLengths(graph, start, end)
-
-    # symbolic equations defining relationship between system parameters, 
-    # energy consumption and masses
-    battCap, battMass = sp.symbols('battCap, battMass')     # sympy symbols
-
-    tMass = baseMass + payloadMass + battMass           # mass with payload              
-    eMass = baseMass + battMass                     # mass w/out payload              
-    
-    if charge:
-        # if WPT is used adds WPT onboard mass
-        tMass += WPTmass
-        eMass += WPTmass
-        
-    # converts the drone masses to an estimated power consumption in hover
-    #fullW = 4*((tMass/4)*thrustM + thrustC)        # power used in W w/payload
-    #emptyW = 4*((eMass/4)*thrustM + thrustC)       # power used in W w/out payload
-    fullW = 4*(thrustA*(tMass/4)**2 + thrustB*(tMass/4))
-    emptyW = 4*(thrustA*(eMass/4)**2 + thrustB*(eMass/4))
-
-    # calculates one-way flight time per section
-    oWayFlT1 = ((lenF1+penalty)/cruiseSpeed)/3600   # flight time in hr, accounting for TOL penalty
-    oWayFlT2 = 0
-    if lenR !=0:
-        # if bus used, second stage flight time, adds second TOL penalty
-        oWayFlT2 = ((lenF2+penalty)/cruiseSpeed)/3600
-
-    # flight energy consumptions on forward and return, as functions of battery mass
-    energyF1 = oWayFlT1*(fullW+miscW)
-    energyF2 = oWayFlT2*(fullW+miscW)
-    energyR1 = oWayFlT1*(emptyW+miscW)
-    energyR2 = oWayFlT2*(emptyW+miscW)
-    energyT = energyF1+energyF2+energyR1+energyR2       # total estimated consumption
-
-    energyST = battST*(fullW+miscW)   # energy for safety hover time
-    energyN = energyT+energyST         
-    battCap = (energyN/safeDischarge)    # safe battery capacity as function of battery mass
-
-    chargeFull1 = 0     # binary - does battery reach full charge on forward bus-ride 
-    chargeFull2 = 0     # binary - does battery reach full charge on return bus-ride
-    chAct1 = 0          # charge energy on forward bus ride
-    chAct2 = 0          # charge energy on return bus ride
-
-    if charge and lenR>0:
-        # if charging available and buses used, adjusts battery capacity based on WPT
-        # calculates max charge received, if battery capacity is available
-        chTime = (lenR/1000)/busSpeed                         # one way time on bus in hr
-        chRates = {'low': actChargeRate, 'high': thChargeRate}  # charge powers in W
-        chRate = chRates[charge]                                
-        oWMaxCh = chRate*chTime         # max one-way battery charge .
-        # defines charge received as the minimum of the max one-way battery charge and 
-        # the remaining battery consumption based on energy used in flight since last charge
-        # as functions of battery mass
-        ch1 = sp.Piecewise((energyF1, energyF1<oWMaxCh), (oWMaxCh, True))
-        ch2 = sp.Piecewise((energyF2+energyR2, energyF2+energyR2<oWMaxCh), (oWMaxCh, True))
-
-        # updated necessary battery capacity as function of battery mass
-        battCap = ((energyN-ch1-ch2)/safeDischarge)
-        # solves for minimum battery mass
-        minBattMass = sp.solve(battMass - battCap/battED, battMass)[0]
-        # rounds battery mass up to nearest available battery size
-        #actBattMass = math.ceil(minBattMass/bMStep)*bMStep
-        actBattMass =minBattMass
-        # substitutes battery mass to calculate charge power received 
-        chAct1 = ch1.subs(battMass, actBattMass)
-        chAct2 = ch2.subs(battMass, actBattMass)
-        # updates binary metrics to show if battery reached full capacity in charge stages
-        if chAct1<oWMaxCh:
-            chargeFull1 = 1
-        if chAct2<oWMaxCh:
-            chargeFull2 = 1      
-       
-    else:
-        # solves for battery mass if charging not used
-        battCap = (energyN/safeDischarge)
-        minBattMass = sp.solve(battMass - battCap/battED, battMass)[0]
-        actBattMass = math.ceil(minBattMass/bMStep)*bMStep
-
-    # calculates battery capacity
-    battCap = actBattMass*battED
-    # substitutes battery mass to find total flight energy consumption
-    energyT = (energyT).subs(battMass,actBattMass)
-    # calculates geodisic delivery distance from coordinates
-    distance = haversine(start[1],start[0],end[1],end[0])
-
-    return np.array([[distance, battCap, actBattMass, energyT, lenF1/1000, lenR/1000, lenF2/1000, chAct1, chAct2, chargeFull1, chargeFull2, payloadMass, endN]])
-
+    lengths = lengths or findPathLengths(graph, start, end)
+    rows = battDistRows(start, [end], [lengths], payloadMass, charge)
+    if np.isnan(rows[0, 2]):
+        raise ValueError('No battery size can complete the route')
+    return rows
+
+def battDistRows(start, ends, lengths, payloadMass, charge=False):
+    # Determines the minimum battery sizes of an array of routes from start in one solve,
+    # given their end points (lat, lon), findPathLengths outputs and payload masses,
+    # returning a battDistOptP row per route. Rows of routes no battery size can
+    # complete have NaN battery mass and capacity.
+    lenF1, lenR, lenF2, endN = np.array(lengths, dtype=float).reshape(-1, 4).T
+
+    # solves for battery size, adding WPT onboard mass and charging at the
+    # specified charge power in W if WPT is used
+    chRates = {'low': actChargeRate, 'high': thChargeRate}
+    chRate = chRates[charge] if charge else 0
+    actBattMass, battCap, energyT, chAct1, chAct2, chargeFull1, chargeFull2 = battMassSolve(
+        lenF1, lenR, lenF2, payloadMass, chRate, bool(charge))
+
+    # calculates geodisic delivery distances from coordinates
+    ends = np.atleast_2d(np.asarray(ends, dtype=float))
+    distance = haversine(start[1], start[0], ends[:,1], ends[:,0])
+
+    return np.column_stack((distance, battCap, actBattMass, energyT, lenF1/1000, lenR/1000, lenF2/1000, chAct1, chAct2,
+                            chargeFull1, chargeFull2, np.broadcast_to(payloadMass, lenF1.shape), endN))
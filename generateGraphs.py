@@ -1,123 +1,230 @@
 
 import osmnx as ox
-import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
 import networkx as nx
 import os
+import json
+import hashlib
+import multiprocessing as mp
 import areaDef as ar
-
-# fetches expanded bounding box coordinates
-bN,bE,bS,bW = ar.bBoxes[1]
-# fetches warehouse name
-warehouse = ar.warehouse
-# fetches start/end point coordinates
-N,E,S,W = ar.bBoxes[0]
-start = ar.start
-
-
-# imports open street map graph of area
-area = ox.graph_from_bbox(bN,bS,bE,bW, network_type="drive", simplify=True)
-P = ox.project_graph(area, to_crs='WGS84')
-
-# identifies and removes duplicate edges between each pair of nodes
-parallelEdges = []
-for u,v in P.edges():
-    if len(P[u][v])>1:
-        if [u,v] not in parallelEdges:
-            parallelEdges.append([u,v])
-for u,v in parallelEdges:
-    P.remove_edge(u,v,1)
-
-# for every edge, adds travel method attribute with default as fly and energy consumption with placeholder value=length
-for u,v in P.edges():
-    length = P[u][v][0]['length']
-    nx.set_edge_attributes(P,{(u,v, 0):{'method': 'fly', 'energy':length, 'cost':length, 'oneway': False}})
-
-# plots area map
-fig, ax = plt.subplots()
-ox.plot_graph(P, bgcolor='none', node_size=0, edge_color='black', edge_linewidth= 0.5, show=False, close=False, ax = ax)
-
-# saves graph with flight-only energy attributes
-ox.save_graphml(P, filepath="graphs\\" + warehouse + "flight.graphml")
+import graphStore as gS
+import spatialIndex as sI
+from scenario import Scenario
+
+# max road distance (m) between consecutive stops on the same bus route section
+maxStopGap = 1000
+
+
+def areaGraph(routeBounds):
+    # imports open street map graph of area
+    bN,bE,bS,bW = routeBounds
+    area = ox.graph_from_bbox(bN,bS,bE,bW, network_type="drive", simplify=True)
+    P = ox.project_graph(area, to_crs='WGS84')
+    return cleanGraph(P)
+
+def cleanGraph(P):
+    # identifies and removes duplicate edges between each pair of nodes, keeping edge key 0,
+    # in one pass over the edges
+    parallelEdges = [(u, v, k) for u, v, k in P.edges(keys=True) if k != 0]
+    P.remove_edges_from(parallelEdges)
+
+    # for every edge, adds travel method attribute with default as fly and energy consumption with placeholder value=length
+    # by updating the edge data in place
+    for _, _, d in P.edges(data=True):
+        length = d['length']
+        d.update(method='fly', energy=length, cost=length, oneway=False)
+    return P
 
 def wtBusEdges(route, P):
     # adds travel method and energy consumption attributes to edges of graph P
     # along the route based on energy consumption of hitch-hikinge
-    for n in range(len(route)-1):
-        u = route[n]
-        v = route[n+1]
-        length = P[u][v][0]['length']
-        nx.set_edge_attributes(P,{(u,v, 0):{'method': 'ride'}})
-
-def nrNodeNrEdge(P, pLat, pLon):
-    # efficiently estimates nearest node to each bus stop by  finding its nearest edge
-    # then calculating which edge end-node is closest (max distance node -> stop 170m)
-    u, v, key = ox.nearest_edges(P, pLat, pLon)
-    ux = P.nodes[u]['x']-pLon
-    uy = P.nodes[u]['y']-pLat
-    vx = P.nodes[v]['x']-pLon
-    vy = P.nodes[v]['y']-pLat
-    du = (ux*ux+uy*uy)
-    dv = (vx*vx+vy*vy)
-    if du < dv:
-        nodeid = u
+    for u, v in zip(route[:-1], route[1:]):
+        P[u][v][0]['method'] = 'ride'
+
+def stopPath(P, a, b):
+    # finds the shortest road path between consecutive stop nodes a and b in one search,
+    # which stops at maxStopGap; returns None if there is no path within it
+    try:
+        _, path = nx.single_source_dijkstra(P, a, b, cutoff=maxStopGap, weight='length')
+    except nx.NetworkXNoPath:
+        return None
+    return path
+
+# graph searched by pool workers, set by initPathWorker
+workerGraph = None
+
+def initPathWorker(P):
+    # stores the graph in each worker
+    global workerGraph
+    workerGraph = P
+
+def pathWorker(pairs):
+    # finds the stop paths for a chunk of stop node pairs
+    return [stopPath(workerGraph, a, b) for a, b in pairs]
+
+def stopPaths(P, pairs, nWorkers=1):
+    # finds the stop paths for a list of (a, b) stop node pairs, returned as a dict
+    # nWorkers > 1 splits the pairs into chunks across a process pool
+    if nWorkers > 1 and len(pairs) > nWorkers:
+        size = -(-len(pairs)//(nWorkers*4))
+        chunks = [pairs[i:i+size] for i in range(0, len(pairs), size)]
+        method = 'fork' if 'fork' in mp.get_all_start_methods() else None
+        with mp.get_context(method).Pool(nWorkers, initPathWorker, (P,)) as pool:
+            paths = [path for chunk in pool.map(pathWorker, chunks) for path in chunk]
     else:
-        nodeid = v
-    return nodeid
-
-# creates list of busline stop file names
-fileDir = 'busData\\' + warehouse +'LineStops\\'
-lineFiles = os.listdir(fileDir)
-
-# creates empty array to store all bus routes
-allBusRoutes =[]
-
-# iterates through bus-line file and generates map route based on bus-stop nearest nodes
-for fName in lineFiles:
-    # loads bus stop id and coordinate data into np array
-    data = pd.read_csv(fileDir+fName)
-    bStops = np.column_stack((np.array(data['0']), np.array(data['2']),np.array(data['1'])))
-
-    # create list of nearest node to each bus stop
-    stopNodes = np.array([ox.nearest_nodes(P, s[2], s[1]) for s in bStops])
-    # removes duplicates (in case of close stops with same nearest node)
-    stopNodes = list(dict.fromkeys(stopNodes))
-    
-    busRoute = []
-    # iterates through the bus stop nodes
-    for i in range(len(stopNodes)-1):
-        
-        try:
-            # finds a path between consecutive nodes
-            path = nx.shortest_path(P, stopNodes[i], stopNodes[i+1], weight='length')[:-1]
-        except:
-            # if there is no path (bus route leaves and re-enters the graph)
-            # ends route section and adds it to bus routes array
-            busRoute.append(stopNodes[i])
-            allBusRoutes.append(busRoute)
-            # creates new empty section
-            busRoute = []
-        else:
-            # if there is a path >1km also ends route section and adds it to bus routes array
-            if nx.shortest_path_length(P, stopNodes[i], stopNodes[i+1], weight='length') > 1000:
-                busRoute.append(stopNodes[i])
-                allBusRoutes.append(busRoute)
+        paths = [stopPath(P, a, b) for a, b in pairs]
+    return dict(zip(pairs, paths))
+
+def lineStopNodes(P, fileDir, fNames):
+    # returns the nearest graph nodes to the stops of each of the bus-line files in fileDir
+    lines = {}
+    for fName in fNames:
+        # loads bus stop id and coordinate data into np array
+        data = pd.read_csv(os.path.join(fileDir, fName))
+        bStops = np.column_stack((np.array(data['0']), np.array(data['2']),np.array(data['1'])))
+
+        # create list of nearest node to each bus stop, snapping all stops in one query
+        stopNodes, snaps = sI.snapNodes(P, bStops[:,1:3].astype(float))
+        if np.any(snaps > sI.maxSnap):
+            print(fName, 'stops snapped over', sI.maxSnap, 'm: ', np.sum(snaps > sI.maxSnap))
+        # removes duplicates (in case of close stops with same nearest node)
+        lines[fName] = list(dict.fromkeys(stopNodes.tolist()))
+    return lines
+
+def lineRoutes(P, fileDir, fNames=None, nWorkers=1, pathCache=None):
+    # estimates the bus route sections on graph P for each of the bus-line stop files in
+    # fileDir (default all), returned as a dict of file name -> route sections
+    # the path between each pair of consecutive stop nodes is found once, however many lines
+    # share it, and kept in pathCache (if given) for later rebuilds of the same graph
+    if fNames is None:
+        fNames = sorted(os.listdir(fileDir))
+    lines = lineStopNodes(P, fileDir, fNames)
+    pathCache = {} if pathCache is None else pathCache
+    pairs = [pair for stopNodes in lines.values() for pair in zip(stopNodes[:-1], stopNodes[1:])]
+    pairs = [pair for pair in dict.fromkeys(pairs) if pair not in pathCache]
+    pathCache.update(stopPaths(P, pairs, nWorkers))
+
+    # iterates through bus-lines and generates map route based on bus-stop nearest nodes
+    routes = {}
+    for fName, stopNodes in lines.items():
+        # creates empty array to store the line's route sections
+        lineRoute = []
+        busRoute = []
+        # iterates through the bus stop nodes
+        for a, b in zip(stopNodes[:-1], stopNodes[1:]):
+            path = pathCache[(a, b)]
+            if path is None:
+                # if there is no path (bus route leaves and re-enters the graph) or the path
+                # is >1km, ends route section and adds it to bus routes array
+                busRoute.append(a)
+                lineRoute.append(busRoute)
+                # creates new empty section
                 busRoute = []
-            # if there is a path <1km adds it the current section of the bus route
             else:
-                busRoute = busRoute + path
-    # adds the final stop node to the route section
-    busRoute.append(stopNodes[-1])
-    allBusRoutes.append(busRoute)
-
-for route in allBusRoutes:
-    # updates energy consumption in all bus route sections
-    wtBusEdges(route, P)
-    ox.plot_graph_route(P, route,bgcolor='none', node_size=0, edge_color='black', edge_linewidth= 0.5,
-                        orig_dest_size=10, show=False, close=False, ax = ax, route_color='r', route_node_size=0, route_linewidth=1)
-
-# saves graph with flight and hitch-hike energy attributes
-ox.save_graphml(P, filepath="graphs\\" + warehouse +"ride.graphml")
-
-plt.show()
+                # if there is a path <1km adds it the current section of the bus route
+                busRoute = busRoute + path[:-1]
+        # adds the final stop node to the route section
+        busRoute.append(stopNodes[-1])
+        lineRoute.append(busRoute)
+        routes[fName] = lineRoute
+    return routes
+
+def routeEdges(routes):
+    # returns the (u, v) edges along a list of route sections
+    return [(u, v) for route in routes for u, v in zip(route[:-1], route[1:])]
+
+def fileHash(fPath):
+    # returns the hash of a file's contents
+    with open(fPath, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def manifestPath(warehouse):
+    # the manifest of the line files used to build a warehouse's ride graph
+    return os.path.join("graphs", warehouse + "ride.manifest.json")
+
+def loadManifest(warehouse):
+    # returns the ride graph manifest as a dict of line file name -> {'hash', 'edges'},
+    # or None if there is none
+    try:
+        with open(manifestPath(warehouse)) as f:
+            lines = json.load(f)['lines']
+    except (OSError, ValueError, KeyError):
+        return None
+    return {fName: {'hash': line['hash'], 'edges': [tuple(e) for e in line['edges']]} for fName, line in lines.items()}
+
+def saveManifest(warehouse, lines):
+    # saves the hash and ride edges of each line file used to build the ride graph
+    with open(manifestPath(warehouse), 'w') as f:
+        json.dump({'lines': {fName: {'hash': line['hash'], 'edges': [list(e) for e in line['edges']]}
+                             for fName, line in sorted(lines.items())}}, f)
+
+def saveRideGraph(P, warehouse, lines):
+    # saves the graph with flight and hitch-hike energy attributes, and its manifest
+    ox.save_graphml(P, filepath=os.path.join("graphs", warehouse + "ride.graphml"))
+    gS.saveGraphArrays(P, os.path.join("graphs", warehouse + "ride"))
+    saveManifest(warehouse, lines)
+
+def buildGraphs(scn, nWorkers=1):
+    # builds and saves the flight and bus graph of the scenario's area; the flight-only
+    # network is its flight layer (routeEngine.flightLayer), so is not saved separately
+    # nWorkers > 1 finds the bus route paths across a process pool
+    warehouse = scn.warehouse
+    P = areaGraph(scn.routeBounds)
+
+    # plots area map
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots()
+    ox.plot_graph(P, bgcolor='none', node_size=0, edge_color='black', edge_linewidth= 0.5, show=False, close=False, ax = ax)
+
+    fileDir = os.path.join('busData', warehouse + 'LineStops')
+    routes = lineRoutes(P, fileDir, nWorkers=nWorkers)
+    for route in (route for lineRoute in routes.values() for route in lineRoute):
+        # updates energy consumption in all bus route sections
+        wtBusEdges(route, P)
+        ox.plot_graph_route(P, route,bgcolor='none', node_size=0, edge_color='black', edge_linewidth= 0.5,
+                            orig_dest_size=10, show=False, close=False, ax = ax, route_color='r', route_node_size=0, route_linewidth=1)
+
+    lines = {fName: {'hash': fileHash(os.path.join(fileDir, fName)), 'edges': routeEdges(lineRoute)}
+             for fName, lineRoute in routes.items()}
+    saveRideGraph(P, warehouse, lines)
+
+    plt.show()
+
+def updateRideGraph(scn, nWorkers=1):
+    # incrementally rebuilds the scenario's ride graph after bus-line files are added, removed
+    # or edited: only the changed lines are re-routed, and only the edges whose ride status
+    # changed are updated in the saved ride graph, without downloading the area again
+    # falls back to a full build if there is no previous build to update
+    warehouse = scn.warehouse
+    fileDir = os.path.join('busData', warehouse + 'LineStops')
+    ridePath = os.path.join("graphs", warehouse + "ride.graphml")
+    oldLines = loadManifest(warehouse)
+    if oldLines is None or not os.path.exists(ridePath):
+        print('No previous ride graph build, building', warehouse, 'graphs')
+        return buildGraphs(scn, nWorkers)
+
+    hashes = {fName: fileHash(os.path.join(fileDir, fName)) for fName in sorted(os.listdir(fileDir))}
+    changed = [fName for fName in hashes if fName not in oldLines or oldLines[fName]['hash'] != hashes[fName]]
+    removed = [fName for fName in oldLines if fName not in hashes]
+    print('Lines changed: ', len(changed), ' removed: ', len(removed))
+    if not changed and not removed:
+        return
+
+    P = ox.load_graphml(ridePath)
+    routes = lineRoutes(P, fileDir, changed, nWorkers)
+    lines = {fName: oldLines[fName] for fName in hashes if fName not in routes}
+    lines.update({fName: {'hash': hashes[fName], 'edges': routeEdges(routes[fName])} for fName in changed})
+
+    # updates the edges ridden by no line any more, and those newly ridden
+    oldEdges = {e for line in oldLines.values() for e in line['edges']}
+    newEdges = {e for line in lines.values() for e in line['edges']}
+    for u, v in oldEdges - newEdges:
+        P[u][v][0]['method'] = 'fly'
+    for u, v in newEdges - oldEdges:
+        P[u][v][0]['method'] = 'ride'
+    print('Edges changed to fly: ', len(oldEdges - newEdges), ' to ride: ', len(newEdges - oldEdges))
+    saveRideGraph(P, warehouse, lines)
+
+if __name__ == '__main__':
+    buildGraphs(Scenario(ar.warehouse))
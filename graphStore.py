@@ -0,0 +1,121 @@
+# Defines a compact binary format for the saved area graphs, as a directory of raw .npy
+# arrays: CSR adjacency, node ids and coordinates, and per-edge length, travel method code
+# and geometry. The arrays are memory-mapped on loading, so startup takes milliseconds and
+# processes loading the same graph share its pages. Loaded graphs (StoredGraph) are routed
+# on the arrays, and a networkx graph is only built from them when it is needed, e.g. for
+# plotting with osmnx.
+
+import os
+import numpy as np
+import networkx as nx
+from shapely.geometry import LineString
+
+# edge travel method codes
+methodCodes = {'fly': 0, 'ride': 1}
+methodNames = ['fly', 'ride']
+
+# arrays saved for each graph
+arrayNames = ['indptr', 'indices', 'nodeIds', 'nodeX', 'nodeY', 'length', 'method', 'geomPtr', 'geomX', 'geomY']
+
+def graphArrays(P):
+    # converts a graph to CSR arrays, with the edges ordered by their source node
+    nodeIds = np.array(list(P.nodes()), dtype=np.int64)
+    index = {n: i for i, n in enumerate(nodeIds.tolist())}
+    nodeX = np.array([d['x'] for _, d in P.nodes(data=True)], dtype=np.float64)
+    nodeY = np.array([d['y'] for _, d in P.nodes(data=True)], dtype=np.float64)
+
+    edges = sorted(P.edges(keys=True, data=True), key=lambda e: index[e[0]])
+    src = np.array([index[u] for u, _, _, _ in edges], dtype=np.int64)
+    indices = np.array([index[v] for _, v, _, _ in edges], dtype=np.int64)
+    indptr = np.searchsorted(src, np.arange(len(nodeIds)+1)).astype(np.int64)
+    length = np.array([d['length'] for *_, d in edges], dtype=np.float64)
+    method = np.array([methodCodes[d.get('method', 'fly')] for *_, d in edges], dtype=np.uint8)
+
+    # edge geometries as ragged coordinate arrays, empty for straight edges
+    coords = [np.asarray(d['geometry'].coords) if 'geometry' in d else np.empty((0, 2)) for *_, d in edges]
+    geomPtr = np.concatenate(([0], np.cumsum([len(c) for c in coords]))).astype(np.int64)
+    allCoords = np.concatenate(coords) if coords else np.empty((0, 2))
+    return {'indptr': indptr, 'indices': indices, 'nodeIds': nodeIds, 'nodeX': nodeX, 'nodeY': nodeY,
+            'length': length, 'method': method, 'geomPtr': geomPtr,
+            'geomX': allCoords[:, 0].copy(), 'geomY': allCoords[:, 1].copy()}
+
+def saveGraphArrays(P, dirPath):
+    # saves a graph as a directory of .npy arrays
+    os.makedirs(dirPath, exist_ok=True)
+    for name, arr in graphArrays(P).items():
+        np.save(os.path.join(dirPath, name + '.npy'), arr)
+
+def loadGraphArrays(dirPath, mmap=True):
+    # loads the arrays of a saved graph, memory-mapped (read-only) by default
+    mode = 'r' if mmap else None
+    return {name: np.load(os.path.join(dirPath, name + '.npy'), mmap_mode=mode) for name in arrayNames}
+
+def hasGraphArrays(dirPath):
+    # checks if a graph has been saved in the binary format
+    return all(os.path.exists(os.path.join(dirPath, name + '.npy')) for name in arrayNames)
+
+def arraysToGraph(arrays):
+    # builds a networkx graph equivalent to the osmnx graph the arrays were saved from,
+    # for routing with networkx or plotting with osmnx, and returns it with its own edge
+    # attribute dicts in CSR order (networkx copies the dicts it is given)
+    P = nx.MultiDiGraph(crs='epsg:4326')
+    P.add_nodes_from(nodeList(arrays))
+    edgeData = []
+    for u, v, data in edgeList(arrays):
+        k = P.add_edge(u, v, **data)
+        edgeData.append(P[u][v][k])
+    return P, edgeData
+
+def nodeList(arrays):
+    # returns the (node, attributes) of the saved nodes
+    return [(n, {'x': x, 'y': y, 'lon': x, 'lat': y})
+            for n, x, y in zip(arrays['nodeIds'].tolist(), arrays['nodeX'].tolist(), arrays['nodeY'].tolist())]
+
+def edgeList(arrays):
+    # returns the (u, v, attributes) of the saved edges, in CSR order
+    nodeIds = arrays['nodeIds'].tolist()
+    indptr, geomPtr = arrays['indptr'], np.asarray(arrays['geomPtr'])
+    src = np.repeat(np.arange(len(nodeIds)), np.diff(indptr))
+    geomX, geomY = arrays['geomX'], arrays['geomY']
+    edges = []
+    for e, (i, j, length, method) in enumerate(zip(src.tolist(), arrays['indices'].tolist(),
+                                                   arrays['length'].tolist(), arrays['method'].tolist())):
+        data = {'length': length, 'method': methodNames[method], 'energy': length, 'cost': length, 'oneway': False}
+        g0, g1 = geomPtr[e], geomPtr[e+1]
+        if g1 > g0:
+            data['geometry'] = LineString(np.column_stack((geomX[g0:g1], geomY[g0:g1])))
+        edges.append((nodeIds[i], nodeIds[j], data))
+    return edges
+
+class StoredGraph:
+    # A graph loaded from its saved arrays, which the route engine and spatial index use
+    # as they are. Its networkx graph is only built on first use (toNetworkx), e.g. for
+    # routing with the networkx backend or plotting with osmnx. Layer views of the graph
+    # (see routeEngine.flightLayer) share its arrays, and keep it as _graph, as networkx
+    # views do
+    def __init__(self, arrays, attrs=None, base=None):
+        self.arrays = arrays
+        self.graph = {'crs': 'epsg:4326'} if attrs is None else attrs
+        self._graph = base
+        self.networkx = None
+        # attribute dicts of the networkx graph's edges, in CSR order
+        self.edgeData = None
+
+    def __repr__(self):
+        return f"StoredGraph({len(self.arrays['nodeIds'])} nodes, {len(self.arrays['indices'])} edges)"
+
+    def view(self, **attrs):
+        # returns a view sharing the graph's arrays, with added graph attributes
+        return StoredGraph(self.arrays, dict(self.graph, **attrs), self)
+
+    def toNetworkx(self):
+        # returns the networkx graph, sharing the graph attributes, building it on first
+        # use; the networkx graph of a view is a frozen view of its graph's networkx graph
+        if self.networkx is None:
+            if self._graph is not None:
+                P = nx.graphviews.generic_graph_view(self._graph.toNetworkx())
+            else:
+                P, self.edgeData = arraysToGraph(self.arrays)
+            P.graph = self.graph
+            self.networkx = P
+        return self.networkx
@@ -0,0 +1,53 @@
+# Runs the model stages for several warehouses in one pass. Stop discovery runs once for
+# all areas in the parent process, sharing the stop index, TFL response cache and the stops
+# of lines that pass through more than one area. Graph building and energy sampling then run
+# for each warehouse in parallel worker processes, each routing with its own graphs and
+# tree caches (and its own pool of route workers if requested).
+
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+stages = ['find-stops', 'build-graphs', 'sample-energy']
+
+def runWarehouse(scn, runStages, sampleArgs, nWorkers=1, incremental=False):
+    # builds (or incrementally updates) the graphs and/or samples the energy data of one
+    # warehouse's scenario
+    if 'build-graphs' in runStages:
+        import generateGraphs as gG
+        if incremental:
+            gG.updateRideGraph(scn, nWorkers)
+        else:
+            gG.buildGraphs(scn, nWorkers)
+    if 'sample-energy' in runStages:
+        import routingV2 as r2
+        N,E,S,W = scn.bounds
+        nSamples, payloadMass, chRate, chRate2, type, nWorkers, id = sampleArgs
+        lowWPT, highWPT, nWPT, nBus = r2.getEnergyData(scn, nSamples, scn.startLL, [N,S,E,W], payloadMass,
+                                                       chRate, chRate2, type, nWorkers)
+        r2.saveData(lowWPT, highWPT, nWPT, nBus, id, scn.warehouse)
+    return scn.warehouse
+
+def runPipeline(scns, runStages=stages, sampleArgs=None, nProcs=None, nWorkers=1, incremental=False):
+    # runs the stages for a list of scenarios (one per warehouse)
+    # sampleArgs = (nSamples, payloadMass, chRate, chRate2, type, nWorkers, id) for energy sampling
+    # nProcs limits the warehouses processed at once (default: all), and nWorkers sets the
+    # bus route path workers used by each graph build
+    # incremental only updates the existing ride graphs for changed bus-line files
+    unknown = set(runStages) - set(stages)
+    if unknown:
+        raise ValueError('Unknown stages: ' + ', '.join(sorted(unknown)))
+    if 'sample-energy' in runStages and sampleArgs is None:
+        raise ValueError('sampleArgs needed for the sample-energy stage')
+    if 'find-stops' in runStages:
+        import findBusStops as fBS
+        fBS.findLineStops(scns)
+    runStages = [s for s in runStages if s != 'find-stops']
+    if not runStages:
+        return []
+    if len(scns) == 1 or nProcs == 1:
+        return [runWarehouse(scn, runStages, sampleArgs, nWorkers, incremental) for scn in scns]
+
+    method = 'fork' if 'fork' in mp.get_all_start_methods() else None
+    with ProcessPoolExecutor(nProcs or len(scns), mp.get_context(method)) as pool:
+        futures = [pool.submit(runWarehouse, scn, runStages, sampleArgs, nWorkers, incremental) for scn in scns]
+        return [f.result() for f in futures]
@@ -0,0 +1,36 @@
+# Defines conversions between British National Grid Eastings/Northings and WGS84
+# latitude/longitude. pyproj Transformers are built once and cached (per thread, as they
+# are not thread-safe), and convert whole arrays of coordinates in a single call.
+
+import threading
+import numpy as np
+from pyproj import Transformer
+
+BNG = 'EPSG:27700'          # British National Grid
+WGS84 = 'EPSG:4326'         # latitude/longitude
+
+local = threading.local()
+
+def getTransformer(fromCRS, toCRS):
+    # returns the cached transformer between two coordinate systems, with
+    # coordinates ordered (x, y), i.e. (easting, northing) or (lon, lat)
+    if not hasattr(local, 'transformers'):
+        local.transformers = {}
+    key = (fromCRS, toCRS)
+    if key not in local.transformers:
+        local.transformers[key] = Transformer.from_crs(fromCRS, toCRS, always_xy=True)
+    return local.transformers[key]
+
+def bng2wgs(eastings, northings):
+    # converts Eastings/Northings (scalars or arrays) to latitudes and longitudes
+    lons, lats = getTransformer(BNG, WGS84).transform(np.asarray(eastings, dtype=float), np.asarray(northings, dtype=float))
+    if np.ndim(lats) == 0:
+        return float(lats), float(lons)
+    return lats, lons
+
+def wgs2bng(lats, lons):
+    # converts latitudes and longitudes (scalars or arrays) to Eastings/Northings
+    eastings, northings = getTransformer(WGS84, BNG).transform(np.asarray(lons, dtype=float), np.asarray(lats, dtype=float))
+    if np.ndim(eastings) == 0:
+        return float(eastings), float(northings)
+    return eastings, northings
@@ -0,0 +1,553 @@
+# Defines a single-source route engine for routing out of a fixed origin (the warehouse).
+# One Dijkstra search per (graph, source, weight) produces a shortest-path tree holding
+# each node's predecessor and the flight/ride distance totals of its route, so any
+# destination is answered by walking back up the tree rather than re-running a search.
+# Searches run with networkx, or with scipy's csgraph on CSR matrices of the edge weights.
+# Graphs are networkx graphs, or StoredGraphs loaded from saved arrays, which the scipy
+# backend routes on directly, building their networkx graph only for the networkx backend.
+# The flight and ride networks share one topology: the flight-only network is a layer view
+# of the ride graph on which every edge is flown, so only one graph is held in memory.
+# Penalty weights search over (node, travel mode) states instead, charging the take-off and
+# landing penalty each time the drone boards a bus, so it rides only where this pays off.
+
+import threading
+import weakref
+import numpy as np
+import networkx as nx
+import spatialIndex as sI
+import graphStore as gS
+import scipy.sparse as sparse
+from scipy.sparse import csgraph
+
+# shortest-path trees per graph, keyed by (source, weight), and snapped origin nodes
+# per graph, keyed by (lat, lon). Weak keys drop the entries when a graph is discarded
+treeCache = weakref.WeakKeyDictionary()
+originCache = weakref.WeakKeyDictionary()
+cacheLock = threading.Lock()
+# edge arrays and CSR weight matrices per graph, for the scipy backend
+csrCache = weakref.WeakKeyDictionary()
+# weight version per graph, advanced when its edge weights are replaced in place. Trees and
+# arrays built under an older version, including those of its flight layer, are rebuilt
+weightVersions = weakref.WeakKeyDictionary()
+# weight version last written to each graph's edge attributes, which only networkx
+# routing reads, so replaced weight arrays are written there when next needed
+syncedVersions = weakref.WeakKeyDictionary()
+
+# travel modes of the penalty weight search states
+notBoarded, riding, alighted = 0, 1, 2
+
+# shortest-path backend used to build trees: 'networkx' or 'scipy'
+backend = 'networkx'
+
+def setBackend(name):
+    # selects the shortest-path backend used for new trees
+    global backend
+    if name not in ('networkx', 'scipy'):
+        raise ValueError(f"Unknown backend {name}")
+    backend = name
+
+def originNode(graph, point):
+    # returns the graph node nearest to a (lat, lon) origin, snapping it only once per graph
+    with cacheLock:
+        nodes = originCache.setdefault(graph, {})
+    point = (float(point[0]), float(point[1]))
+    if point not in nodes:
+        nodes[point] = sI.snapNode(graph, point)
+    return nodes[point]
+
+def flightLayer(graph):
+    # returns the flight-only layer of a ride graph: a read-only view sharing the graph's
+    # nodes, edges and edge data, on which every edge is flown and weighted by its flight
+    # energy (flWhkm from the graph attributes, or the edge length for unweighted graphs)
+    if isinstance(graph, gS.StoredGraph):
+        return graph.view(layer='flight')
+    view = nx.graphviews.generic_graph_view(graph)
+    view.graph = dict(graph.graph, layer='flight')
+    return view
+
+def isFlightLayer(graph):
+    # checks if a graph is a flight-only layer view
+    return graph.graph.get('layer') == 'flight'
+
+def flightWeight(graph):
+    # returns the flight energy (and cost) per m of edge length on a graph
+    return baseGraph(graph).graph.get('flWhkm', 1000)/1000
+
+def baseGraph(graph):
+    # returns the graph a layer view shares its topology with (the graph itself otherwise)
+    return graph._graph if isFlightLayer(graph) else graph
+
+def weightVersion(graph):
+    # returns the version of a graph's edge weights (shared by its flight layer)
+    return weightVersions.get(baseGraph(graph), 0)
+
+def costWeight(cost, busWhkm, flWhkm):
+    # returns a weight key for routing with the cost factor applied to ride edges, so
+    # queries with different cost factors need no change to the graph's edge attributes
+    return ('cost', cost, busWhkm, flWhkm)
+
+def penaltyWeight(weight, penalty, multiLeg=True):
+    # returns a weight key for routing on (node, travel mode) states with a weight, where
+    # boarding a bus (a ride edge entered while flying) adds penalty, in the weight's units.
+    # The route is not boarded, riding or alighted at each node; multiLeg allows boarding
+    # again after alighting, for routes with several bus legs
+    return ('penalty', weight, penalty, multiLeg)
+
+def isPenaltyWeight(weight):
+    # checks if a weight key is a penalty weight
+    return isinstance(weight, tuple) and weight[0] == 'penalty'
+
+def weightFunction(weight, graph=None):
+    # converts a weight key into the weight used by Dijkstra: attribute names are used
+    # as they are, cost weight keys become a function of edge length and method.
+    # On a flight layer the energy and cost weights are the edges' flight weights
+    flight = graph is not None and isFlightLayer(graph)
+    if isinstance(weight, str):
+        if flight and weight in ('energy', 'cost'):
+            flyW = flightWeight(graph)
+            return lambda u, v, d: min(flyW*e['length'] for e in d.values())
+        return weight
+    _, cost, busWhkm, flWhkm = weight
+    flyW = flWhkm/1000
+    rideW = flyW if flight else cost*busWhkm/1000
+    def costFunc(u, v, d):
+        return min((rideW if e['method'] == 'ride' else flyW)*e['length'] for e in d.values())
+    return costFunc
+
+def buildTree(graph, source, weight):
+    # runs one Dijkstra search from source, and returns the shortest-path tree with the
+    # totals of each node's route: (pre-bus flight, ride, ride energy, post-bus flight, energy)
+    # penalty weights are searched over the mode states, as a matrix or a networkx graph
+    if backend == 'scipy':
+        return buildTreesCSR(graph, [source], weight)[0]
+    if isPenaltyWeight(weight):
+        return buildStateTree(graph, source, weight)
+    graph = networkxGraph(graph)
+    pred, dist = nx.dijkstra_predecessor_and_distance(graph, source, weight=weightFunction(weight, graph))
+    flight, flyW = isFlightLayer(graph), flightWeight(graph)
+    pred = {v: p[0] for v, p in pred.items() if p}
+    totals = {source: (0, 0, 0, 0, 0, False)}
+    for node in dist:
+        # walks up to the nearest node with known totals, then fills in the totals on the way down
+        branch = []
+        v = node
+        while v not in totals:
+            branch.append(v)
+            v = pred[v]
+        lenF1, lenR, enR, lenF2, energy, rode = totals[v]
+        while branch:
+            u, v = v, branch.pop()
+            edge = graph[u][v][0]
+            edgeEnergy = flyW*edge['length'] if flight else edge['energy']
+            if not flight and edge['method'] == 'ride':
+                rode = True
+                lenR += edge['length']
+                enR += edgeEnergy
+            elif rode:
+                lenF2 += edge['length']
+            else:
+                lenF1 += edge['length']
+            energy += edgeEnergy
+            totals[v] = (lenF1, lenR, enR, lenF2, energy, rode)
+    return {'source': source, 'weight': weight, 'pred': pred, 'dist': dist, 'totals': totals}
+
+def graphArrays(graph):
+    # returns the node list, node index and edge arrays of a graph, extracting them once.
+    # A flight layer shares the node and edge arrays of its ride graph, with no ride edges
+    # and flight energy weights
+    version = weightVersion(graph)
+    with cacheLock:
+        arrs = csrCache.get(graph)
+    if arrs is not None and arrs['version'] != version:
+        arrs = None
+    if arrs is None and isFlightLayer(graph):
+        base = graphArrays(baseGraph(graph))
+        flyEnergy = flightWeight(graph)*base['length']
+        arrs = dict(base, matrices={}, method=np.zeros_like(base['method']), energy=flyEnergy, cost=flyEnergy)
+        with cacheLock:
+            csrCache[graph] = arrs
+    elif arrs is None and isinstance(graph, gS.StoredGraph):
+        # reads the saved CSR arrays, with the edge lengths as the initial weights
+        a = graph.arrays
+        nodes = a['nodeIds'].tolist()
+        length = np.asarray(a['length'])
+        arrs = {'nodes': nodes, 'index': {n: i for i, n in enumerate(nodes)}, 'matrices': {}, 'version': version,
+                'u': np.repeat(np.arange(len(nodes)), np.diff(a['indptr'])), 'v': np.asarray(a['indices']),
+                'method': np.asarray(a['method']) == gS.methodCodes['ride'],
+                'length': length, 'energy': length, 'cost': length}
+        with cacheLock:
+            arrs = csrCache.setdefault(graph, arrs)
+    elif arrs is None:
+        nodes = list(graph.nodes())
+        index = {n: i for i, n in enumerate(nodes)}
+        edges = list(graph.edges(data=True))
+        arrs = {'nodes': nodes, 'index': index, 'matrices': {}, 'version': version,
+                'data': [d for *_, d in edges],
+                'u': np.array([index[u] for u, _, _ in edges], dtype=np.int64),
+                'v': np.array([index[v] for _, v, _ in edges], dtype=np.int64),
+                'method': np.array([d['method'] == 'ride' for *_, d in edges], dtype=bool),
+                'length': np.array([d['length'] for *_, d in edges], dtype=np.float64),
+                'energy': np.array([d['energy'] for *_, d in edges], dtype=np.float64),
+                'cost': np.array([d['cost'] for *_, d in edges], dtype=np.float64)}
+        with cacheLock:
+            arrs = csrCache.setdefault(graph, arrs)
+    return arrs
+
+def setEdgeWeights(graph, energy, cost):
+    # replaces the energy and cost weights of a graph's edges with arrays in graphArrays
+    # edge order, and advances its weight version so its cached trees (and those of its
+    # flight layer) are rebuilt. The arrays are used for routing as they are, and only
+    # written to the edge attributes if the graph is next routed with networkx
+    arrs = graphArrays(graph)
+    with cacheLock:
+        version = weightVersions.get(graph, 0) + 1
+        weightVersions[graph] = version
+        csrCache[graph] = dict(arrs, matrices={}, version=version, energy=energy, cost=cost)
+
+def weightArray(arrs, weight):
+    # returns the array of an attribute or cost weight over the edges in graphArrays
+    if isinstance(weight, str):
+        return arrs[weight]
+    _, cost, busWhkm, flWhkm = weight
+    return np.where(arrs['method'], cost*busWhkm/1000, flWhkm/1000)*arrs['length']
+
+def modeEdges(arrs, weight):
+    # returns the state edges (u, v, weight, graph edge id) of a penalty weight search, with
+    # state (node i, mode m) numbered m*nV + i. Flight edges keep or end a ride (not boarded
+    # -> not boarded, riding -> alighted, alighted -> alighted), and ride edges board or
+    # continue one (not boarded -> riding with penalty, riding -> riding, and if multiLeg
+    # alighted -> riding with penalty)
+    _, baseWeight, penalty, multiLeg = weight
+    nV = len(arrs['nodes'])
+    w = weightArray(arrs, baseWeight)
+    ride = arrs['method']
+    moves = [(notBoarded, notBoarded, ~ride, 0), (riding, alighted, ~ride, 0), (alighted, alighted, ~ride, 0),
+             (notBoarded, riding, ride, penalty), (riding, riding, ride, 0)]
+    if multiLeg:
+        moves.append((alighted, riding, ride, penalty))
+    u, v, ws, ids = [], [], [], []
+    for m1, m2, mask, pen in moves:
+        e = np.flatnonzero(mask)
+        u.append(m1*nV + arrs['u'][e])
+        v.append(m2*nV + arrs['v'][e])
+        ws.append(w[e] + pen)
+        ids.append(e)
+    return np.concatenate(u), np.concatenate(v), np.concatenate(ws), np.concatenate(ids)
+
+def networkxGraph(graph):
+    # returns a graph as networkx, for routing with networkx or plotting: the graph itself,
+    # or the networkx graph of a StoredGraph, built on first use. Its edges' energy and
+    # cost attributes are written from its weight arrays if these have been replaced
+    # since they were last written
+    base = baseGraph(graph)
+    stored = isinstance(base, gS.StoredGraph)
+    if stored:
+        base.toNetworkx()
+    with cacheLock:
+        version = weightVersions.get(base, 0)
+        if syncedVersions.get(base, 0) != version:
+            arrs = csrCache[base]
+            data = base.edgeData if stored else arrs['data']
+            for d, e, c in zip(data, arrs['energy'].tolist(), arrs['cost'].tolist()):
+                d['energy'] = e
+                d['cost'] = c
+            syncedVersions[base] = version
+    return graph.toNetworkx() if stored else graph
+
+def weightMatrix(graph, weight):
+    # returns the CSR matrix of a weight over the graph, keeping the lowest weight of
+    # parallel edges, with the graph edge ids of its entries and their sorted (u, v) keys
+    # Penalty weights give a matrix over the (node, travel mode) states
+    arrs = graphArrays(graph)
+    mats = arrs['matrices']
+    if weight not in mats:
+        if isPenaltyWeight(weight):
+            u, v, w, ids = modeEdges(arrs, weight)
+            nS = 3*len(arrs['nodes'])
+        else:
+            u, v, w = arrs['u'], arrs['v'], weightArray(arrs, weight)
+            ids = np.arange(len(u))
+            nS = len(arrs['nodes'])
+        order = np.lexsort((w, v, u))
+        keys = u[order]*nS + v[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = keys[1:] != keys[:-1]
+        order, keys = order[first], keys[first]
+        matrix = sparse.csr_matrix((w[order], (u[order], v[order])), shape=(nS, nS))
+        mats[weight] = (matrix, ids[order], keys)
+    return mats[weight]
+
+def stateGraph(graph, weight):
+    # returns the networkx graph of the mode states of a penalty weight, with the entries
+    # of its weight matrix as edges, for searching it with the networkx backend
+    arrs = graphArrays(graph)
+    mats = arrs['matrices']
+    key = ('networkx', weight)
+    if key not in mats:
+        matrix = weightMatrix(graph, weight)[0].tocoo()
+        S = nx.DiGraph()
+        S.add_nodes_from(range(matrix.shape[0]))
+        S.add_weighted_edges_from(zip(matrix.row.tolist(), matrix.col.tolist(), matrix.data.tolist()))
+        mats[key] = S
+    return mats[key]
+
+def fillTotals(arrs, pred, root, edgeIds, keys):
+    # returns the route totals (pre-bus flight, ride, ride energy, post-bus flight, energy,
+    # rode) of each node of a tree given by its predecessor array, filled one tree level at
+    # a time, each node adding its tree edge to its parent's totals
+    nS = len(pred)
+    # tree edge of each reached node, and its children grouped by parent
+    child = np.flatnonzero(pred >= 0)
+    parent = pred[child]
+    edge = edgeIds[np.searchsorted(keys, parent*nS + child)]
+    order = np.argsort(parent, kind='stable')
+    child, parent, edge = child[order], parent[order], edge[order]
+    ptr = np.searchsorted(parent, np.arange(nS+1))
+
+    totals = np.zeros((nS, 6))
+    frontier = np.array([root])
+    while frontier.size:
+        counts = ptr[frontier+1] - ptr[frontier]
+        at = np.arange(counts.sum()) - np.repeat(np.cumsum(counts)-counts, counts) + np.repeat(ptr[frontier], counts)
+        kids, e = child[at], edge[at]
+        prev = totals[parent[at]]
+        ride = arrs['method'][e]
+        rode = (prev[:, 5] > 0) | ride
+        length, energy = arrs['length'][e], arrs['energy'][e]
+        totals[kids, 0] = prev[:, 0] + length*(~ride & ~rode)
+        totals[kids, 1] = prev[:, 1] + length*ride
+        totals[kids, 2] = prev[:, 2] + energy*ride
+        totals[kids, 3] = prev[:, 3] + length*(~ride & rode)
+        totals[kids, 4] = prev[:, 4] + energy
+        totals[kids, 5] = rode
+        frontier = kids
+    return totals
+
+def buildTreesCSR(graph, sources, weight):
+    # runs one csgraph Dijkstra call from all the sources, and returns a shortest-path
+    # tree per source, with its predecessors, distances and totals held in arrays
+    arrs = graphArrays(graph)
+    matrix, edgeIds, keys = weightMatrix(graph, weight)
+    rows = [arrs['index'][s] for s in sources]
+    dist, pred = csgraph.dijkstra(matrix, indices=rows, return_predecessors=True)
+    return [arrayTree(graph, source, weight, pred[k], dist[k]) for k, source in enumerate(sources)]
+
+def buildStateTree(graph, source, weight):
+    # runs one networkx Dijkstra search from source over the mode states of a penalty
+    # weight, and returns its tree in the same arrays as buildTreesCSR
+    arrs = graphArrays(graph)
+    root = arrs['index'][source]
+    preds, dists = nx.dijkstra_predecessor_and_distance(stateGraph(graph, weight), root)
+    pred = np.full(3*len(arrs['nodes']), -9999, dtype=np.int32)
+    dist = np.full(len(pred), np.inf)
+    reached = np.array(list(dists), dtype=np.int64)
+    dist[reached] = list(dists.values())
+    pred[[v for v, p in preds.items() if p]] = [p[0] for p in preds.values() if p]
+    return arrayTree(graph, source, weight, pred, dist)
+
+def arrayTree(graph, source, weight, pred, dist):
+    # returns the tree of a search from source given its predecessor and distance arrays,
+    # with the totals of each node. Trees of penalty weights also hold the best mode state
+    # of each node, which its distance and totals are read from
+    arrs = graphArrays(graph)
+    _, edgeIds, keys = weightMatrix(graph, weight)
+    nV = len(arrs['nodes'])
+    totals = fillTotals(arrs, pred, arrs['index'][source], edgeIds, keys)
+    tree = {'source': source, 'weight': weight, 'pred': pred, 'dist': dist,
+            'totals': totals, 'index': arrs['index'], 'nodes': arrs['nodes']}
+    if isPenaltyWeight(weight):
+        best = np.argmin(dist.reshape(3, nV), axis=0)*nV + np.arange(nV)
+        tree.update(dist=dist[best], totals=totals[best], best=best)
+    return tree
+
+def graphTrees(graph):
+    # returns the dict of cached trees of a graph, emptied if its weights have changed
+    # since they were built (called with cacheLock held)
+    version = weightVersion(graph)
+    entry = treeCache.get(graph)
+    if entry is None or entry[0] != version:
+        entry = treeCache[graph] = (version, {})
+    return entry[1]
+
+def getTree(graph, source, weight):
+    # returns the cached shortest-path tree for (graph, source, weight), building it if needed
+    with cacheLock:
+        trees = graphTrees(graph)
+        tree = trees.get((source, weight))
+    if tree is None:
+        tree = buildTree(graph, source, weight)
+        with cacheLock:
+            tree = trees.setdefault((source, weight), tree)
+    return tree
+
+def getTrees(graph, sources, weight):
+    # returns the cached trees for several sources, building the missing ones together
+    # in a single multi-source search with the scipy backend
+    with cacheLock:
+        trees = graphTrees(graph)
+        missing = [s for s in dict.fromkeys(sources) if (s, weight) not in trees]
+    if backend == 'scipy' and missing:
+        built = buildTreesCSR(graph, missing, weight)
+        with cacheLock:
+            for source, tree in zip(missing, built):
+                trees.setdefault((source, weight), tree)
+    return [getTree(graph, s, weight) for s in sources]
+
+def clearTrees(graph=None, weight=None):
+    # discards cached trees for a graph (or for all graphs) after its edge attributes are
+    # changed, so its weights are read from them again, or only its trees for one weight
+    # once they are no longer needed. StoredGraphs keep their weight arrays, which are
+    # only changed with setEdgeWeights
+    with cacheLock:
+        graphs = set(treeCache) | set(csrCache) if graph is None else {graph}
+    if weight is None:
+        # first writes any replaced weight arrays to the edge attributes, so they are kept
+        for g in graphs:
+            if not isinstance(baseGraph(g), gS.StoredGraph):
+                networkxGraph(g)
+    with cacheLock:
+        for g in graphs:
+            if weight is None:
+                treeCache.pop(g, None)
+                if isinstance(g, gS.StoredGraph) and not isFlightLayer(g):
+                    csrCache.get(g, {'matrices': {}})['matrices'].clear()
+                else:
+                    csrCache.pop(g, None)
+            else:
+                trees = treeCache.get(g, (0, {}))[1]
+                for key in [k for k in trees if k[1] == weight]:
+                    del trees[key]
+                mats = csrCache.get(g, {'matrices': {}})['matrices']
+                mats.pop(weight, None)
+                mats.pop(('networkx', weight), None)
+
+def treeNode(tree, end):
+    # returns the key of end in the tree's arrays or dicts, raising if end is unreachable
+    if 'index' in tree:
+        i = tree['index'].get(end)
+        if i is not None and np.isfinite(tree['dist'][i]):
+            return i
+    elif end in tree['dist']:
+        return end
+    raise nx.NetworkXNoPath(f"No path to {end}.")
+
+def treeDist(tree, end):
+    # returns the total route weight from the tree source to end
+    return float(tree['dist'][treeNode(tree, end)])
+
+def nodePath(tree, i):
+    # returns the route from the tree source to the node with tree key i as a list of nodes
+    path = [i]
+    pred = tree['pred']
+    if 'index' in tree:
+        # walks back through the mode states of penalty weight trees (source not boarded)
+        nV = len(tree['nodes'])
+        if 'best' in tree:
+            path = [tree['best'][i]]
+        root = tree['index'][tree['source']]
+        while path[-1] != root:
+            path.append(pred[path[-1]])
+        path = [tree['nodes'][j % nV] for j in path]
+    else:
+        while path[-1] != tree['source']:
+            path.append(pred[path[-1]])
+    path.reverse()
+    return path
+
+def treePath(tree, end):
+    # returns the route from the tree source to end as a list of nodes
+    return nodePath(tree, treeNode(tree, end))
+
+def treeTotals(tree, end):
+    # returns (pre-bus flight, ride, ride energy, post-bus flight, energy) totals for the
+    # route to end, with lengths in m
+    return tuple(float(x) for x in tree['totals'][treeNode(tree, end)][:5])
+
+def treeRoute(tree, end):
+    # returns the path, total weight and totals of the route to end, locating end once
+    i = treeNode(tree, end)
+    return nodePath(tree, i), float(tree['dist'][i]), tuple(float(x) for x in tree['totals'][i][:5])
+
+def route(graph, source, end, weight):
+    # returns the route from source to end minimising weight, as (path, total weight, totals),
+    # with the totals split into (pre-bus flight, ride, ride energy, post-bus flight, energy).
+    # It is read from a cached tree, so a search only runs for the first query from source
+    # with each weight
+    return treeRoute(getTree(graph, source, weight), end)
+
+def costEnvelopes(graph, source, ends, busWhkm, flWhkm, cMin, cMax, penalty=None):
+    # Finds, for each end node, the lower envelope of route cost against the ride cost
+    # factor over [cMin, cMax]. A route costs cost*a*ride + b*flight, plus penalty if it
+    # boards a bus, so each route is a line in the cost factor and the optimum changes
+    # only at the envelope breakpoints. With a penalty, the trees are single bus leg
+    # penalty weight searches, as in weightedMER.
+    # Trees are run at the cost factors where adjacent optimal routes have equal cost,
+    # until every such crossing is confirmed, and each tree serves all of the end nodes.
+    # Returns a dict of end node -> (breakpoint cost factors, route totals between them).
+    a, b = busWhkm/1000, flWhkm/1000
+    pen = penalty or 0
+
+    def weightAt(cost):
+        weight = costWeight(cost, busWhkm, flWhkm)
+        return weight if penalty is None else penaltyWeight(weight, penalty, multiLeg=False)
+
+    def endTotals(tree):
+        totals = {}
+        for end in ends:
+            try:
+                totals[end] = treeTotals(tree, end)
+            except nx.NetworkXNoPath:
+                totals[end] = None
+        return totals
+
+    def boards(A):
+        # number of bus legs charged the penalty (at most one)
+        return 1 if A[1] > 0 else 0
+
+    def crossing(A, B):
+        # cost factor at which routes A and B (lenF1, lenR, enR, lenF2, ...) have equal cost
+        return (b*((B[0]+B[3])-(A[0]+A[3])) + pen*(boards(B)-boards(A)))/(a*(A[1]-B[1]))
+
+    def sameRoute(A, B):
+        return (abs(A[1]-B[1]) < 1e-6 and abs((A[0]+A[3])-(B[0]+B[3])) < 1e-6
+                and boards(A) == boards(B))
+
+    samples = {cMin: endTotals(getTree(graph, source, weightAt(cMin))),
+               cMax: endTotals(getTree(graph, source, weightAt(cMax)))}
+    while True:
+        costs = sorted(samples)
+        requests = set()
+        for end in ends:
+            for lo, hi in zip(costs[:-1], costs[1:]):
+                A, B = samples[lo][end], samples[hi][end]
+                if A is None or sameRoute(A, B):
+                    continue
+                # routes differ, so the crossing is a breakpoint unless a cheaper route is found there
+                cross = crossing(A, B)
+                if not (lo+1e-9 < cross < hi-1e-9):
+                    continue
+                requests.add(cross)
+        if not requests:
+            break
+        for cost in requests:
+            samples[cost] = endTotals(buildTree(graph, source, weightAt(cost)))
+            clearTrees(graph, weightAt(cost))
+
+    envelopes = {}
+    costs = sorted(samples)
+    for end in ends:
+        if samples[cMin][end] is None:
+            continue
+        breaks, routes = [], [samples[cMin][end]]
+        for cost in costs[1:]:
+            route = samples[cost][end]
+            if not sameRoute(routes[-1], route):
+                breaks.append(crossing(routes[-1], route))
+                routes.append(route)
+        envelopes[end] = (breaks, routes)
+    return envelopes
+
+def envelopeTotals(envelope, costs):
+    # reads the optimal route totals at each of the given cost factors from an envelope
+    breaks, routes = envelope
+    return [routes[i] for i in np.searchsorted(breaks, costs)]
@@ -5,23 +5,25 @@
 # to generate routes on an unweighted graph, accounting for a cost factor (for V1)
  
 
-import networkx as nx
-import osmnx as ox
-import matplotlib.pyplot as plt
 import areaDef as ar
 from areaDef import haversine
 import numpy as np
 from math import *
 import areaDef as ar
-from matplotlib import rc
+import threading
+import weakref
+import routeEngine as rE
+import graphStore as gS
+import spatialIndex as sI
+
+# weighted ride graphs and flight layers in use, by warehouse and weights (and layer);
+# weak values drop the entries when the graphs are discarded
+loadedGraphs = weakref.WeakValueDictionary()
+graphLock = threading.Lock()
 
 # System parameters
 disPen = 1.1 
 sBus = 15                   # bus speed in km/hr
-bN,bE,bS,bW = ar.bBoxes[1]  # bounding box for routes
-N,E,S,W = ar.bBoxes[0]      # bounding box for delivery locations
-start = ar.startLL          # start location (specified warehouse)
-warehouse = ar.warehouse    # warehouse name
 
 ''' # To plot relationships for V1 with costParametersPlot
 busWhkm = 0.72              # bus ride Wh/km
@@ -47,34 +49,62 @@ gDO = '#D36027'
 gO = '#E6A024'
 gB = '#0273B3'
 gLB = '#5BB4E5'
-# changes font for all plots
-rc('font',**{'family':'sans-serif','sans-serif':['Arial']})  
-
-def loadGraph(fName, busWhkm, flWhkm):
-    # loads graph from file for analysis of impact of cost
-    P = ox.load_graphml('graphs/'+warehouse+fName+'.graphml')
-    # changes energy attribute value to V1 version
-    for u,v in P.edges():
-        if P[u][v][0]['method'] == 'ride':
-            P[u][v][0]['energy'] = float(busWhkm/1000 * P[u][v][0]['length'])
-            P[u][v][0]['cost'] = float(busWhkm/1000 * P[u][v][0]['length'])
-        else:
-            P[u][v][0]['energy'] = float(flWhkm/1000 * P[u][v][0]['length'])
-            P[u][v][0]['cost'] = float(flWhkm/1000 * P[u][v][0]['length'])
+
+def plotStyle():
+    # imports pyplot for the plotting functions, with the font of all plots set
+    import matplotlib.pyplot as plt
+    plt.rc('font',**{'family':'sans-serif','sans-serif':['Arial']})
+    return plt
+
+def readGraph(fName, warehouse=ar.warehouse):
+    # loads a saved graph from its memory-mapped binary arrays if they have been
+    # generated, as a StoredGraph routed on the arrays, otherwise by parsing its GraphML file
+    dirPath = 'graphs/'+warehouse+fName
+    if gS.hasGraphArrays(dirPath):
+        return gS.StoredGraph(gS.loadGraphArrays(dirPath))
+    import osmnx as ox
+    return ox.load_graphml(dirPath+'.graphml')
+
+def edgeWeights(length, ride, busWhkm, flWhkm, cost=1):
+    # returns the energy and cost weights of edges from their length and ride mask arrays,
+    # with the cost factor applied to ride edges
+    energy = np.where(ride, busWhkm, flWhkm)/1000*length
+    return energy, np.where(ride, energy*cost, energy)
+
+def weightGraph(P, busWhkm, flWhkm, cost=1):
+    # sets the energy and cost attributes of a loaded graph's edges, computed as arrays over
+    # its edge lengths and methods, so a graph can be re-weighted (e.g. in a parameter
+    # sweep) without reloading it. Cached routes on the graph are discarded
+    arrs = rE.graphArrays(P)
+    P.graph['flWhkm'] = flWhkm
+    rE.setEdgeWeights(P, *edgeWeights(arrs['length'], arrs['method'], busWhkm, flWhkm, cost))
     return P
 
-def loadCostedGraph(fName, busWhkm, flWhkm, cost):
+def sharedGraph(fName, busWhkm, flWhkm, cost, warehouse):
+    # returns the weighted ride graph of a warehouse, or its flight layer, loading the ride
+    # graph only if no graph with the same weights is still in use, so the ride and flight
+    # graphs loaded separately share one topology
+    key = (warehouse, busWhkm, flWhkm, cost)
+    with graphLock:
+        P = loadedGraphs.get(key)
+        if P is None:
+            P = loadedGraphs[key] = weightGraph(readGraph('ride', warehouse), busWhkm, flWhkm, cost)
+        if fName != 'flight':
+            return P
+        flight = loadedGraphs.get(key + ('flight',))
+        if flight is None:
+            flight = loadedGraphs[key + ('flight',)] = rE.flightLayer(P)
+        return flight
+
+def loadGraph(fName, busWhkm, flWhkm, warehouse=ar.warehouse):
+    # loads graph from file for analysis of impact of cost, with V1 energy attributes
+    # 'flight' returns the flight layer of the ride graph, which shares its topology
+    return sharedGraph(fName, busWhkm, flWhkm, 1, warehouse)
+
+def loadCostedGraph(fName, busWhkm, flWhkm, cost, warehouse=ar.warehouse):
     # loads graph from file, for a specified fixed cost
-    P = ox.load_graphml('graphs/'+warehouse+fName+'.graphml')
-    # changes energy attribute value to V1 version
-    for u,v in P.edges():
-        if P[u][v][0]['method'] == 'ride':
-            P[u][v][0]['energy'] = float(busWhkm/1000 * P[u][v][0]['length'])
-            P[u][v][0]['cost'] = float(busWhkm/1000 * P[u][v][0]['length']*cost)
-        else:
-            P[u][v][0]['energy'] = float(flWhkm/1000 * P[u][v][0]['length'])
-            P[u][v][0]['cost'] = float(flWhkm/1000 * P[u][v][0]['length'])
-    return P
+    # 'flight' returns the flight layer of the ride graph, which shares its topology
+    return sharedGraph(fName, busWhkm, flWhkm, cost, warehouse)
 
 def genRanCoords(maxN, maxS, maxE, maxW, nCoords):
     # generates a n pairs of random coordinate within the defined area
@@ -86,19 +116,12 @@ def genRanCoords(maxN, maxS, maxE, maxW, nCoords):
     randCoords = np.column_stack((randLats, randLons))
     return randCoords
 
-def minEnergyRoute(graph, end, sBus, sFly):
+def minEnergyRoute(graph, start, end, sBus, sFly):
     # uses Dijkstras based on the energy attribute of edges to return the
     # lowest energy route from start to end, its estimated energy consumption,
     # and the distances flown and hitch-hiked
-    path = nx.shortest_path(graph, start, end, weight='energy')
-    energy = nx.shortest_path_length(graph, start, end, weight='energy')
-    lenRide, lenFly = 0, 0
-    for i in range(len(path)-1):
-        u, v = path[i], path[i+1]
-        if graph[u][v][0]['method'] == 'ride':
-            lenRide += graph[u][v][0]['length']/1000
-        else:
-            lenFly += graph[u][v][0]['length']/1000
+    path, energy, (lenF1, lenR, _, lenF2, _) = rE.route(graph, rE.originNode(graph, start), end, 'energy')
+    lenRide, lenFly = lenR/1000, (lenF1+lenF2)/1000
     pnPen = 1
     if lenRide != 0:
         pnPen+=1
@@ -106,54 +129,61 @@ def minEnergyRoute(graph, end, sBus, sFly):
     routeData = (path, energy, lenRide, lenFly, time)
     return routeData
 
-def weightedMER(graph, end, cost, busWhkm, flWhkm, sBus, sFly):
+def weightedMER(graph, start, end, cost, busWhkm, flWhkm, sBus, sFly):
     # adapted version of the minEnergyRoute function which finds the shortest
     # path incorporating a cost for bus use
-    startN = ox.nearest_nodes(graph, start[1], start[0])
-    P = graph
-    for u,v in P.edges():
-        if P[u][v][0]['method'] == 'ride':
-            P[u][v][0]['cost'] = float(cost*busWhkm/1000 * P[u][v][0]['length'])
-    costGraph = P
-    path = nx.shortest_path(costGraph, startN, end, weight='cost')
-    lenRide, lenFly, energy = 0, 0, 0
-    for i in range(len(path)-1):
-        u, v = path[i], path[i+1]
-        #print(energy)
-        if graph[u][v][0]['method'] == 'ride':
-            lenRide += graph[u][v][0]['length']/1000
-            energy += graph[u][v][0]['energy']
-        else:
-            lenFly += graph[u][v][0]['length']/1000
-            energy += graph[u][v][0]['energy']
+    # the cost factor is applied by the search weight, leaving the graph unchanged,
+    # and the search charges the take-off/landing penalty of the bus leg when boarding
+    startN = rE.originNode(graph, start)
+    weight = rE.penaltyWeight(rE.costWeight(cost, busWhkm, flWhkm), disPen*flWhkm, multiLeg=False)
+    path, _, totals = rE.route(graph, startN, end, weight)
+    energy, lenRide, lenFly, time = routeEstimates(totals, flWhkm, sBus, sFly)
+    routeData = (path, energy, lenRide, lenFly, time)
+    return routeData
+
+def routeEstimates(totals, flWhkm, sBus, sFly):
+    # converts route totals from the route engine into the energy, distances ridden and
+    # flown (km), and journey time of the route, including take-off/landing penalties
+    lenF1, lenR, _, lenF2, energy = totals
+    lenRide, lenFly = lenR/1000, (lenF1+lenF2)/1000
     pnPen = 1
     if lenRide != 0:
         pnPen+=1
     time = 60*lenRide/sBus + 60*(lenFly+(pnPen*disPen))/sFly       # estimates- journey time in min
     energy += pnPen*disPen*flWhkm
-    routeData = (path, energy, lenRide, lenFly, time)
-    return routeData
+    return energy, lenRide, lenFly, time
 
-def costParameterPlot(graph1,graph2, costs, nSamples, busWhkm, flWhkm, sBus, sFly):
+def costParameterPlot(graph1,graph2, start, destBounds, costs, nSamples, busWhkm, flWhkm, sBus, sFly):
     # Plots two graphs showing the relationship between the average increase  in 
     # journey time and decrease in energy consumption for different cost factors.
     # Graphs used to subjectively determine appropriate trade-off and cost factor
+    plt = plotStyle()
     cData = []
     rData = []
     eData = []
     tData = []
     
-    startLat,startLon = start
-    startN = ox.nearest_nodes(graph1, startLon, startLat)
+    N,S,E,W = destBounds
     randCoords = genRanCoords(N,S,E,W,nSamples)
+    dests, _ = sI.snapNodes(graph1, randCoords)
+    dests = dests.tolist()
+    # finds each destination's optimal routes across the whole cost factor range once,
+    # then reads the route for every cost factor from the envelope without re-routing
+    # the envelopes charge the take-off/landing penalty in the search, as weightedMER does
+    envelopes = []
+    for graph in (graph1, graph2):
+        startN = rE.originNode(graph, start)
+        envelopes.append(rE.costEnvelopes(graph, startN, dests, busWhkm, flWhkm, min(costs), max(costs),
+                                          disPen*flWhkm))
     for i in range(nSamples):
         print(i)
-        lat, lon = randCoords[i]
-        dest = ox.nearest_nodes(graph1, lon, lat)
-        for cost in costs:
-            _, energy1, _, _, time1 = weightedMER(graph1, dest, cost, busWhkm, flWhkm, sBus, sFly)
+        dest = dests[i]
+        routes1 = rE.envelopeTotals(envelopes[0][dest], costs)
+        routes2 = rE.envelopeTotals(envelopes[1][dest], costs)
+        for cost, route1, route2 in zip(costs, routes1, routes2):
+            energy1, _, _, time1 = routeEstimates(route1, flWhkm, sBus, sFly)
             # print('fly: ',energy1, time1)
-            _, energy2, _, _, time2 = weightedMER(graph2, dest, cost, busWhkm, flWhkm, sBus, sFly)
+            energy2, _, _, time2 = routeEstimates(route2, flWhkm, sBus, sFly)
             # print('ride: ', energy2, time2)
             tInc = (time2-time1)/time1  #increase in time, to be minimised
             eDec = (energy1-energy2)/energy1      #decrease in energy, to be maximised
@@ -195,6 +225,6 @@ def costParameterPlot(graph1,graph2, costs, nSamples, busWhkm, flWhkm, sBus, sFl
     ax1.minorticks_on()
     plt.show()
 
-#flightP = loadGraph('flight', busWhkm, flWhkm)
-#rideP = loadGraph('ride', busWhkm, flWhkm)
-#costParameterPlot(flightP,rideP, np.linspace(1,30,91), 20, busWhkm, flWhkm, sBus, sFly)
+#scn = Scenario(version='V1')     # from scenario import Scenario
+#N,E,S,W = scn.bounds
+#costParameterPlot(scn.graph('flight'), scn.graph('ride'), scn.startLL, [N,S,E,W], np.linspace(1,30,91), 20, scn.busWhkm, scn.flWhkm, scn.sBus, scn.sFly)
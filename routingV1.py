@@ -1,34 +1,22 @@
-import networkx as nx
-import osmnx as ox
-import matplotlib.pyplot as plt
 import areaDef as ar
 from areaDef import haversine
 import numpy as np
 from math import *
 import areaDef as ar
-from matplotlib import rc
-from sklearn.linear_model import LinearRegression
 
 
 import routeFuncs as rF
+import routeEngine as rE
+import spatialIndex as sI
+from scenario import Scenario
 
 
-# defines system parameters
-busWhkm = 0.72              # bus ride Wh/km
-flWhkm = 24                 # flight Wh/km
+# defines system parameters (drone parameters are set by the V1 Scenario)
 disPen = 1.1                # TOL penalty as an equivalent distance flown
-busTolEn = disPen*flWhkm    # energy penalty for added bus landing + takeoff
-bN,bE,bS,bW = ar.bBoxes[1]  # bounding box for routes
-N,E,S,W = ar.bBoxes[0]      # bounding box for delivery locations
-start = ar.startLL          # start location (specified warehouse)
 nSGraphs = 10               # number of route comparison graphs to show
 nSEff = 300                 # number of routes to compare energy consumption
 nSLens = 300                # number of routes to compare flight/ride distances
-warehouse = ar.warehouse    # warehouse name
-sBus = 15                   # bus speed in km/hr       
-sFly = 36                   # drone speed in km/hr
 
-cost = rF.costV1
 #graph colours
 gR = '#E22526'
 gDO = '#D36027'
@@ -38,54 +26,69 @@ gP = '#CC79A7'
 gB = '#0273B3'
 gLB = '#5BB4E5'
 gG = '#009E73'
-gColors = {'UUK2':[gR,gO], 'DHA1':[gB,gLB], 'DXE1':[gG,gY]}
-gc1 = gColors[warehouse][0]            # graph colour dark
-gc2 = gColors[warehouse][1]            # graph colour light
-# changes font for all plots
-rc('font',**{'family':'sans-serif','sans-serif':['Arial']})  
+gColors = {'UUK2':[gR,gO], 'DHA1':[gB,gLB], 'DXE1':[gG,gY]}   # warehouse graph colours, dark and light
 
 
 def graphTitle(method, energy, length):
     title = method + ": " + str(round(energy,1)) + "Wh\n" + str(round(length,2)) +"km\n"
     return title
 
-def compareRoutes(graph1, name1, graph2, name2, nSamples, destBounds):
+def scnRoute(scn, graph, dest):
+    # finds the cost weighted lowest energy route from the scenario's warehouse to dest
+    return rF.weightedMER(graph, scn.startLL, dest, scn.cost, scn.busWhkm, scn.flWhkm, scn.sBus, scn.sFly)
+
+def destDistances(scn, graph, randCoords):
+    # snaps all destinations to their nearest nodes at once, flagging those far from the
+    # network, and returns the nodes with their geodisic distances from the start (km)
+    startLat, startLon = scn.startLL
+    dests, snaps = sI.snapNodes(graph, randCoords)
+    print('Destinations snapped over', sI.maxSnap, 'm: ', np.sum(snaps > sI.maxSnap))
+    destLats, destLons = sI.nodeCoords(graph, dests)
+    return dests, haversine(startLon, startLat, destLons, destLats)
+
+def compareRoutes(scn, graph1, name1, graph2, name2, nSamples, destBounds):
     # plots maps of the lowest energy drone routes with and without hitchhiking 
     # for n random destination coordinatess
+    plt = rF.plotStyle()
+    import osmnx as ox
+    gc1, gc2 = gColors[scn.warehouse]
     N,S,E,W = destBounds
     randCoords = rF.genRanCoords(N,S,E,W,nSamples)
+    dests, _ = sI.snapNodes(graph1, randCoords)
     fig, ax = plt.subplots(1,nSamples)
     for i in range(nSamples):
         print(i)
         try:
-            lat, lon = randCoords[i]
-            dest = ox.nearest_nodes(graph1, lon, lat)
-            path1, energy1, lenR1, lenF1, _ = rF.weightedMER(graph1, dest, cost, busWhkm, flWhkm, sBus, sFly)
-            path2, energy2, lenR2, lenF2, _ = rF.weightedMER(graph2, dest, cost, busWhkm, flWhkm, sBus, sFly)
+            dest = dests[i]
+            path1, energy1, lenR1, lenF1, _ = scnRoute(scn, graph1, dest)
+            path2, energy2, lenR2, lenF2, _ = scnRoute(scn, graph2, dest)
             axi = ax[i]
-            ox.plot_graph(graph1, bgcolor='none', node_size=0, edge_color='black', edge_linewidth= 0.2, show=False, close=False, ax = axi)
-            ox.plot_graph_route(graph1, path1, orig_dest_size=10, show=False, close=False, ax = axi, route_color=gc1, route_linewidth=2)
-            ox.plot_graph_route(graph2, path2, orig_dest_size=10, show=False, close=False, ax = axi, route_color=gc2, route_linewidth=2)
+            nxGraph1, nxGraph2 = rE.networkxGraph(graph1), rE.networkxGraph(graph2)
+            ox.plot_graph(nxGraph1, bgcolor='none', node_size=0, edge_color='black', edge_linewidth= 0.2, show=False, close=False, ax = axi)
+            ox.plot_graph_route(nxGraph1, path1, orig_dest_size=10, show=False, close=False, ax = axi, route_color=gc1, route_linewidth=2)
+            ox.plot_graph_route(nxGraph2, path2, orig_dest_size=10, show=False, close=False, ax = axi, route_color=gc2, route_linewidth=2)
             axi.set_title((graphTitle(name1, energy1, lenR1+lenF1)+ graphTitle(name2, energy2, lenR2+lenF2)), fontsize=8)
         except:
             print('No route found')
     plt.show()
 
-def compareEff(graph1, name1, graph2, name2, nSamples, destBounds):
+def compareEff(scn, graph1, name1, graph2, name2, nSamples, destBounds):
     # finds the lowest energy drone routes with and without hitchhiking for n random
     # destinations, and plots the energy difference against geodisic delivery distance
-    startLat,startLon = start
+    plt = rF.plotStyle()
+    from sklearn.linear_model import LinearRegression
+    gc1, gc2 = gColors[scn.warehouse]
     N,S,E,W = destBounds
     randCoords = rF.genRanCoords(N,S,E,W,nSamples)
+    dests, distances = destDistances(scn, graph1, randCoords)
     data = []
     for i in range(nSamples):
         print(i)
         try:
-            lat, lon = randCoords[i]
-            dest = ox.nearest_nodes(graph1, lon, lat)
-            distance = haversine(startLon,startLat,graph1.nodes[dest]['lon'],graph1.nodes[dest]['lat'])
-            _, energy1, _, _, _ = rF.weightedMER(graph1, dest, cost, busWhkm, flWhkm, sBus, sFly)
-            _, energy2, _, _, _ = rF.weightedMER(graph2, dest, cost, busWhkm, flWhkm, sBus, sFly)       
+            dest = dests[i]
+            distance = distances[i]
+            _, energy1, _, _, _ = scnRoute(scn, graph1, dest)
+            _, energy2, _, _, _ = scnRoute(scn, graph2, dest)
             data.append([distance, energy1, energy2])
         except:
             print('No route found')
@@ -107,7 +110,7 @@ def compareEff(graph1, name1, graph2, name2, nSamples, destBounds):
     ax.set_xlim(left=0)
     ax.set_xlabel('Geodesic Distance (km)')
     ax.set_ylabel('Reduction in Energy-use (Wh)')
-    ax.set_title('Energy use of {} relative to {} only ({})\n '.format(name2, name1, warehouse))
+    ax.set_title('Energy use of {} relative to {} only ({})\n '.format(name2, name1, scn.warehouse))
     plt.show()
 
     fig, ax = plt.subplots()
@@ -129,12 +132,14 @@ def compareEff(graph1, name1, graph2, name2, nSamples, destBounds):
     ax.legend(['Flight-only routes', 'Hitch-hiking routes', 'Flight-only mean', 'Hitch-hiking mean', 'Electric-van mean'])
     plt.show()
 
-def getLenData(graph1, graph2, nSamples, destBounds):
+def getLenData(scn, graph1, graph2, nSamples, destBounds):
     # finds the lowest energy drone route of the hitchhiking and non-hitchhiking 
     # options and plots the distances ridden and flown against total geodisic distance
-    startLat, startLon = start
+    plt = rF.plotStyle()
+    gc1, gc2 = gColors[scn.warehouse]
     N,S,E,W = destBounds
     randCoords = rF.genRanCoords(N,S,E,W,nSamples)
+    dests, distances = destDistances(scn, graph1, randCoords)
     data = []
     busLen = 0
     nBusLen = 0
@@ -145,11 +150,10 @@ def getLenData(graph1, graph2, nSamples, destBounds):
     for i in range(nSamples):
         print(i)
         try:
-            lat, lon = randCoords[i]
-            dest = ox.nearest_nodes(graph1, lon, lat)
-            distance = haversine(startLon,startLat,graph1.nodes[dest]['lon'],graph1.nodes[dest]['lat'])
-            _, energy1, lenR1, lenF1, _ = rF.weightedMER(graph1, dest, cost, busWhkm, flWhkm, sBus, sFly)
-            _, energy2, lenR2, lenF2, _ = rF.weightedMER(graph2, dest, cost, busWhkm, flWhkm, sBus, sFly)
+            dest = dests[i]
+            distance = distances[i]
+            _, energy1, lenR1, lenF1, _ = scnRoute(scn, graph1, dest)
+            _, energy2, lenR2, lenF2, _ = scnRoute(scn, graph2, dest)
     
             busLen+=lenR2+lenF2
             nBusLen+=lenR1+lenF1
@@ -185,9 +189,12 @@ def getLenData(graph1, graph2, nSamples, destBounds):
     ax.legend(['Bus-ride', 'Flight'])
     plt.show()
 
-flightP = rF.loadGraph('flight', busWhkm, flWhkm)
-rideP = rF.loadGraph('ride', busWhkm, flWhkm)
+if __name__ == '__main__':
+    scn = Scenario(ar.warehouse, 'V1')
+    N,E,S,W = scn.bounds        # bounding box for delivery locations
+    flightP = scn.graph('flight')
+    rideP = scn.graph('ride')
 
-#compareRoutes(flightP, "F", rideP, "F&B", 6, [N,S,E,W])
-#compareEff(flightP, "flight", rideP, "flight and bus-use", nSEff, [N,S,E,W])
-getLenData(flightP, rideP, nSLens, [N,S,E,W])
+    #compareRoutes(scn, flightP, "F", rideP, "F&B", 6, [N,S,E,W])
+    #compareEff(scn, flightP, "flight", rideP, "flight and bus-use", nSEff, [N,S,E,W])
+    getLenData(scn, flightP, rideP, nSLens, [N,S,E,W])
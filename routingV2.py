@@ -2,32 +2,22 @@
 # based on randomnly generated coordinates. Saves/loads this data, and defines 
 # functions to calculate and plot system metrics from it.
 
-import networkx as nx
-import osmnx as ox
-import matplotlib.pyplot as plt
 import areaDef as ar
 from areaDef import haversine
 import numpy as np
 from math import *
 import areaDef as ar
-import pandas as pd
 import csv
 import random
-from sklearn.linear_model import LinearRegression
-from sklearn.preprocessing import PolynomialFeatures
-poly2 = PolynomialFeatures(degree=2, include_bias=False)
-from matplotlib import rc
 import os
-from energyModels import battDistOptP
+import multiprocessing as mp
+import threading
+import weakref
 import energyModels as EM
 import routeFuncs as rF
-import sympy as sp
-
-# fetches location variable values
-bN,bE,bS,bW = ar.bBoxes[1]  # bounding box for routes
-N,E,S,W = ar.bBoxes[0]      # bounding box for delivery locations
-start = ar.startLL          # start location (specified warehouse)
-warehouse = ar.warehouse    # warehouse name
+import routeEngine as rE
+import spatialIndex as sI
+from scenario import Scenario
 
 # graph colours
 gR = '#E22526'
@@ -38,37 +28,23 @@ gP = '#CC79A7'
 gB = '#0273B3'
 gLB = '#5BB4E5'
 gG = '#009E73'
-# changes font for all plots
-rc('font',**{'family':'sans-serif','sans-serif':['Arial']})
-cost = rF.costV2
-
-
-# ESTIMATION OF RATIO OF FLIGHT VS BUS ENERGY CONSUMPTION (V2)
-# mass = sp.symbols('mass')
-# bus energy consumption increase (Wh/km) per g added mass based on bus mass of 20.4 tonnes,
-#consumption 1110Wh/km and linear relationship between mass and energy consumption
-mass = sp.symbols('mass')
-busECkm = mass*1110/2240000
-flECkm = (4*((mass/4)**2*EM.thrustA + (mass/4)*EM.thrustB))/(EM.cruiseSpeed/3.6)
-ECratio = (busECkm/flECkm)
-print(ECratio.subs(mass,2000))
-print(ECratio.subs(mass,2500))
-print(ECratio.subs(mass,3000))
-print(ECratio.subs(mass,3500))
 
 
+def ecRatios(masses):
+    # ESTIMATION OF RATIO OF FLIGHT VS BUS ENERGY CONSUMPTION (V2)
+    # bus energy consumption increase (Wh/km) per g added mass based on bus mass of 20.4 tonnes,
+    #consumption 1110Wh/km and linear relationship between mass and energy consumption
+    import sympy as sp
+    mass = sp.symbols('mass')
+    busECkm = mass*1110/2240000
+    flECkm = (4*((mass/4)**2*EM.thrustA + (mass/4)*EM.thrustB))/(EM.cruiseSpeed/3.6)
+    ECratio = (busECkm/flECkm)
+    return [ECratio.subs(mass,m) for m in masses]
 
-# resulting average (variation +-10%)
+# resulting average (variation +-10%), used as the V2 Scenario's bus energy:flight energy scaling
 # riKwhM = 0.02
 # to decrease ride time
 
-busEnR = 0.02 # scaling used for bus energy:flight energy
-flEnR = 1
-
-# loads graph for specified warehouse
-flightP = rF.loadCostedGraph('flight', busEnR, flEnR, cost)
-rideP = rF.loadCostedGraph('ride', busEnR, flEnR, cost)
-
 def genRanCoords(maxN, maxS, maxE, maxW, nCoords):
     # generates a n pairs of random coordinate within the defined area
     # returns n*2 array
@@ -79,20 +55,101 @@ def genRanCoords(maxN, maxS, maxE, maxW, nCoords):
     randCoords = np.column_stack((randLats, randLons))
     return randCoords
 
-def getEnergyData(nSamples, start, destBounds, payloadMass, chRate, chRate2=False, type=False):
-    # fetches route data to n destinations within the specified area
+# route lengths per graph, as (weight version, {(start, destination node): findPathLengths
+# output}), so the charge scenarios of a destination share one route. Routes found under
+# older edge weights are dropped, and weak keys drop a discarded graph's routes
+routeCache = weakref.WeakKeyDictionary()
+routeLock = threading.Lock()
+
+def pathLengths(graph, start, end):
+    # returns the (lenF1, lenR, lenF2, endN) route lengths to end, routing each
+    # destination node once for the graph's current weights
+    version = rE.weightVersion(graph)
+    endN = sI.snapNode(graph, end)
+    key = (tuple(start), endN)
+    with routeLock:
+        entry = routeCache.get(graph)
+        if entry is None or entry[0] != version:
+            entry = routeCache[graph] = (version, {})
+        lengths = entry[1].get(key)
+    if lengths is None:
+        lengths = EM.findPathLengths(graph, start, end, endN)
+        with routeLock:
+            lengths = entry[1].setdefault(key, lengths)
+    return lengths
+
+def clearRoutes(graph=None):
+    # discards the cached routes of a graph (or of all graphs), e.g. after changing the
+    # take-off/landing penalty; routes are dropped automatically when edge weights change
+    with routeLock:
+        if graph is None:
+            routeCache.clear()
+        else:
+            routeCache.pop(graph, None)
+
+def energyScenarios(scn, chRate, chRate2):
+    # returns the (data row, graph, charge rate) of each scenario, in the order of the
+    # getEnergyData outputs: one/two charge-rate scenarios, no WPT, and flight-only
+    rideP, flightP = scn.graph('ride'), scn.graph('flight')
+    scenarios = [(0, rideP, chRate)]
+    if chRate2:
+        scenarios.append((1, rideP, chRate2))
+    return scenarios + [(2, rideP, False), (3, flightP, False)]
+
+def fillEnergyData(scn, inds, coords, payloads, start, chRate, chRate2, data, found):
+    # fills the preallocated data buffer with the route data for the destinations at inds:
+    # routes each destination of each scenario, then sizes the batteries of each scenario's
+    # routes in one solve. Destinations are found if every scenario has a route that a
+    # battery can complete
+    scenarios = energyScenarios(scn, chRate, chRate2)
+    routed, lengths = [], []
+    for i in inds:
+        print(i)            # route progress counter
+        try:
+            lengths.append([pathLengths(graph, start, coords[k,i]) for k, graph, _ in scenarios])
+            routed.append(i)
+        except:
+            # catches rare isolated map sections so programme can continue
+            print('no path')
+    if not routed:
+        return
+    routed = np.array(routed)
+    solved = np.ones(len(routed), dtype=bool)
+    for s, (k, _, charge) in enumerate(scenarios):
+        rows = EM.battDistRows(start, coords[k,routed], [l[s] for l in lengths], np.asarray(payloads)[routed], charge)
+        data[routed,k] = rows
+        solved &= ~np.isnan(rows[:,2])
+    found[routed] = solved
+
+# route job inputs and shared result buffers for pool workers, set by initEnergyWorker
+workerArgs = None
+
+def initEnergyWorker(scn, coords, payloads, start, chRate, chRate2, dataBuf, foundBuf):
+    # stores the job inputs in each worker, and wraps the shared buffers as arrays
+    global workerArgs
+    data = np.frombuffer(dataBuf, dtype=np.float64).reshape(-1,4,13)
+    found = np.frombuffer(foundBuf, dtype=np.bool_)
+    workerArgs = (scn, coords, payloads, start, chRate, chRate2, data, found)
+
+def energyWorker(inds):
+    # fills the shared buffers for a chunk of destinations
+    scn, *args = workerArgs
+    fillEnergyData(scn, inds, *args)
+
+def getEnergyData(scn, nSamples, start, destBounds, payloadMass, chRate, chRate2=False, type=False, nWorkers=1):
+    # fetches route data to n destinations within the specified area, on the scenario's graphs
     # returns data for flight-only, no WPT, and one or two charge-rate scenarios
     # type can specify that all map nodes should be used as destinations (overrides n) or that 
     # the same destination should be used for all bus/WPT scenarios for direct comparison purposes
     # payload mass defined as integer or array of [min, max] masses for random mass assignment
+    # nWorkers > 1 splits the destinations into chunks across a process pool
 
     N,S,E,W = destBounds
     randCoords1 = genRanCoords(N,S,E,W,nSamples)     # initial random coordinate set
     if type:
         if type=="allNodes":
             # creates coordinate array containing all map nodes within the destination bounds
-            nodes = ox.graph_to_gdfs(flightP, edges=False)
-            rC1 = np.column_stack((nodes['y'].to_numpy(), nodes['x'].to_numpy()))
+            rC1 = np.column_stack(sI.nodeCoords(scn.graph('flight')))
             rC1 = rC1[np.where(np.logical_and(rC1[:,0]>S, rC1[:,0]<N))]
             randCoords1 = rC1[np.where(np.logical_and(rC1[:,1]>W, rC1[:,1]<E))]
         # for allNode or sameDest type, sets all coordinate arrays as equal
@@ -100,38 +157,47 @@ def getEnergyData(nSamples, start, destBounds, payloadMass, chRate, chRate2=Fals
     else:
         # for default type, generates different random coordinate sets
         randCoords2, randCoords3, randCoords4 = genRanCoords(N,S,E,W,nSamples),genRanCoords(N,S,E,W,nSamples),genRanCoords(N,S,E,W,nSamples)
+    coords = np.stack((randCoords1, randCoords2, randCoords3, randCoords4))
+    nRoutes = len(randCoords1)
+    print(nRoutes) # number of routes to be optimised
 
-    # creates arrays for route data
-    WPTP1 = np.empty((0,13))
-    WPTP2 = np.empty((0,13))
-    nWPTP = np.empty((0,13))
-    nBusP = np.empty((0,13))
-    payload = payloadMass
-    print(len(randCoords1)) # number of routes to be optimised
-    for i in range(len(randCoords1)):
-        # iterates through coordinate array and fetches route data for each destination
-        print(i)            # route progress counter
-        if not isinstance(payloadMass, int):
-            # if payload input was a range, generates a random mass
-            payload = random.randint(payloadMass[0], payloadMass[1])
-        end1,end2,end3,end4 = randCoords1[i],randCoords2[i],randCoords3[i],randCoords4[i]
-        try:
-            p1 = battDistOptP(rideP, start, end1, payload, charge=chRate)
-            p3 = battDistOptP(rideP, start, end3, payload)
-            p4 = battDistOptP(flightP, start, end4, payload)
-            if chRate2:
-                p2 = battDistOptP(rideP, start, end2, payload, charge=chRate2)
-                WPTP2 = np.append(WPTP2,p2,axis=0)
-            WPTP1 = np.append(WPTP1, p1, axis=0)
-            nWPTP = np.append(nWPTP,p3,axis=0)
-            nBusP = np.append(nBusP,p4,axis=0)
-        except:
-            # catches rare isolated map sections so programme can continue
-            print('no path')
+    # draws payload masses up front, so that serial and parallel runs use the same masses
+    if isinstance(payloadMass, int):
+        payloads = [payloadMass]*nRoutes
+    else:
+        # if payload input was a range, generates a random mass per route
+        payloads = [random.randint(payloadMass[0], payloadMass[1]) for i in range(nRoutes)]
+
+    if nWorkers > 1:
+        # builds the shortest-path trees before the pool starts, so forked workers
+        # inherit them along with the loaded graphs rather than each rebuilding them
+        for graph in (scn.graph('ride'), scn.graph('flight')):
+            EM.findPathLengths(graph, start, start)
+        # result buffers shared with the workers, which write rows at their route index
+        dataBuf = mp.RawArray('d', nRoutes*4*13)
+        foundBuf = mp.RawArray('b', nRoutes)
+        data = np.frombuffer(dataBuf, dtype=np.float64).reshape(nRoutes,4,13)
+        found = np.frombuffer(foundBuf, dtype=np.bool_)
+        chunks = np.array_split(np.arange(nRoutes), nWorkers*4)
+        method = 'fork' if 'fork' in mp.get_all_start_methods() else None
+        with mp.get_context(method).Pool(nWorkers, initEnergyWorker,
+                                         (scn, coords, payloads, start, chRate, chRate2, dataBuf, foundBuf)) as pool:
+            pool.map(energyWorker, chunks)
+    else:
+        data = np.zeros((nRoutes,4,13))
+        found = np.zeros(nRoutes, dtype=bool)
+        fillEnergyData(scn, range(nRoutes), coords, payloads, start, chRate, chRate2, data, found)
+
+    # keeps the destinations for which every scenario found a route
+    data = data[found]
+    WPTP1, WPTP2, nWPTP, nBusP = data[:,0], data[:,1], data[:,2], data[:,3]
+    if not chRate2:
+        WPTP2 = np.empty((0,13))
     return WPTP1, WPTP2, nWPTP, nBusP
 
 def plotConsumption(p1,p2,leg1,leg2,p3=False,leg3=False, p4=False,leg4=False):
     # plots scatter-plots of energy consumption against distance, 2-4 different scenarios
+    plt = rF.plotStyle()
     fig, ax = plt.subplots()
     al = 0.6
     arrays = [p1,p2]
@@ -169,6 +235,7 @@ def plotCharge(p1,p2):
     # plots a scatter graph of geodisic distance against bus-ride distance, 
     # with marker colours indicating if batteries reached full charge capacities 
     # for 30W and 100W charge rates
+    plt = rF.plotStyle()
     fig, ax = plt.subplots()
     for r in p1:
         if r[9]==0:
@@ -198,6 +265,7 @@ def plotMostEfficient(p1,leg1,p2,leg2,p3,leg3,p4,leg4):
     # plots a graph showing the most efficient delivery scenario for different distances
     # and payload masses, by using marker colours to show flight only, no WPT, low and high WPT
     # array order reversed, so defaults to flight, then no WPT, then low-WPT if efficiencies equal
+    plt = rF.plotStyle()
     arrays = [p4,p3,p2,p1]
     for i in reversed(range(p1.shape[0])):
         print(i)
@@ -229,6 +297,7 @@ def plotMostEfficient(p1,leg1,p2,leg2,p3,leg3,p4,leg4):
 def plotEnergyConsBP(p1,p2, p3):
     # plots box-plots showing energy consumption distribution across 3 input scenarios
     # (high, low and no WPT) for routes above 3km 
+    plt = rF.plotStyle()
     arrays = [p1,p2,p3]
     for i in range(len(arrays)):
         arr = arrays[i]
@@ -247,6 +316,8 @@ def plotEnergyConsBP(p1,p2, p3):
 def plotEnergyConsCh(p1,p2,p3):
     # plots the change in energy consumption from adding 30 and 100W WPT systems
     # averaged across 0.5km intervals, compared to no WPT, bus-riding base case
+    plt = rF.plotStyle()
+    from sklearn.linear_model import LinearRegression
     '''
     arrays = [p1,p2,p3]
     dInt = np.linspace(0.25,10.25,41)
@@ -284,6 +355,8 @@ def plotEnergyConsCh(p1,p2,p3):
 
 def plotTimes(bus, nBus):
     # calculates travel and TOL times based on parameters defined in energy models
+    plt = rF.plotStyle()
+    from sklearn.linear_model import LinearRegression
     bTkm = 60/EM.busSpeed
     fTkm = 60/(EM.cruiseSpeed*3.6)
     TOLT = (EM.penalty/1000)*fTkm
@@ -314,6 +387,8 @@ def plotTimes(bus, nBus):
 
 def plotMEGraph(p1,p2,p3,p4, graph):
     # plots the area network with nodes coloured based on the most efficient method to reach that point
+    plt = rF.plotStyle()
+    import osmnx as ox
     cols = [gDO, gO, gLB, gB]
     arrays = [p4,p3,p2,p1]      # order reversed, so defaults to flight only, then no WPT if efficiencies equal
     for i in reversed(range(p1.shape[0])):
@@ -328,6 +403,7 @@ def plotMEGraph(p1,p2,p3,p4, graph):
         arrays[k]=arrays[k][:,12]
     nc = []
     ns = [] 
+    graph = rE.networkxGraph(graph)
     for n in graph.nodes():
         assigned = False
         for k in range(4):
@@ -344,40 +420,45 @@ def plotMEGraph(p1,p2,p3,p4, graph):
     ox.plot_graph(graph, bgcolor='white', node_color=nc, node_size=ns, node_alpha=0.8, node_zorder=2, edge_color='black', edge_linewidth=0.3, edge_alpha=1)
     plt.show()
           
-def saveFile(data, name):
-    # saves data array into a CSV file
-    dir = os.path.dirname(__file__) + '\\energyData\\' + warehouse + 'ED\\'
+def saveFile(data, name, warehouse=ar.warehouse):
+    # saves data array into a CSV file, in the warehouse's data directory
+    dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'energyData', warehouse + 'ED')
     print(dir)
-    with open(dir+name+'.csv', 'w', encoding='UTF8', newline='') as f:
+    with open(os.path.join(dir, name+'.csv'), 'w', encoding='UTF8', newline='') as f:
         writer = csv.writer(f)
         writer.writerows(data)
 
-def saveData(lowWPT, highWPT, nWPT, nBus, id):
+def saveData(lowWPT, highWPT, nWPT, nBus, id, warehouse=ar.warehouse):
     # saves sets of arrays into CSV files with matched IDs 
-    saveFile(lowWPT, 'lowWPT'+id)
-    saveFile(highWPT, 'highWPT'+id)
-    saveFile(nWPT, 'nWPT'+id)
-    saveFile(nBus, 'nBus'+id)
+    saveFile(lowWPT, 'lowWPT'+id, warehouse)
+    saveFile(highWPT, 'highWPT'+id, warehouse)
+    saveFile(nWPT, 'nWPT'+id, warehouse)
+    saveFile(nBus, 'nBus'+id, warehouse)
 
-def loadData(id):
+def loadData(id, warehouse=ar.warehouse):
     # loads a set of data arrays from files with a given id
-    dir = os.path.dirname(__file__) + '\\energyData\\' + warehouse + 'ED\\'
-    lowWPT = np.loadtxt(dir+"lowWPT"+id+'.csv', delimiter=",", dtype=float)
-    highWPT = np.loadtxt(dir+"highWPT"+id+'.csv', delimiter=",", dtype=float)
-    nWPT = np.loadtxt(dir+"nWPT"+id+'.csv', delimiter=",", dtype=float)
-    nBus = np.loadtxt(dir+"nBus"+id+'.csv', delimiter=",", dtype=float)
+    dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'energyData', warehouse + 'ED')
+    lowWPT = np.loadtxt(os.path.join(dir, "lowWPT"+id+'.csv'), delimiter=",", dtype=float)
+    highWPT = np.loadtxt(os.path.join(dir, "highWPT"+id+'.csv'), delimiter=",", dtype=float)
+    nWPT = np.loadtxt(os.path.join(dir, "nWPT"+id+'.csv'), delimiter=",", dtype=float)
+    nBus = np.loadtxt(os.path.join(dir, "nBus"+id+'.csv'), delimiter=",", dtype=float)
     return lowWPT, highWPT, nWPT, nBus
 
-lowWPT, highWPT, nWPT, nBus = getEnergyData(1000, start, [N,S,E,W], 1000, 'low', 'high', 'sameDest')
-saveData(lowWPT, highWPT, nWPT, nBus, '1000nl_1000')
+if __name__ == '__main__':
+    for m, ratio in zip([2000, 2500, 3000, 3500], ecRatios([2000, 2500, 3000, 3500])):
+        print(m, ratio)
+    scn = Scenario(ar.warehouse, 'V2')
+    N,E,S,W = scn.bounds        # bounding box for delivery locations
+    lowWPT, highWPT, nWPT, nBus = getEnergyData(scn, 1000, scn.startLL, [N,S,E,W], 1000, 'low', 'high', 'sameDest')
+    saveData(lowWPT, highWPT, nWPT, nBus, '1000nl_1000', scn.warehouse)
 
-#lowWPT, highWPT, nWPT, nBus = loadData('all_1000')
+    #lowWPT, highWPT, nWPT, nBus = loadData('all_1000', scn.warehouse)
 
-plotEnergyConsCh(lowWPT, highWPT, nWPT)
-#plotConsumption(lowWPT, highWPT,'30W WPT','100W WPT',nWPT,'No WPT',nBus, 'Flight Only')
-#plotMEGraph(highWPT, lowWPT, nWPT, nBus, flightP)
+    plotEnergyConsCh(lowWPT, highWPT, nWPT)
+    #plotConsumption(lowWPT, highWPT,'30W WPT','100W WPT',nWPT,'No WPT',nBus, 'Flight Only')
+    #plotMEGraph(highWPT, lowWPT, nWPT, nBus, scn.graph('flight'))
 
-#plotTimes(nWPT, nBus)
+    #plotTimes(nWPT, nBus)
 '''
 # Code to calculate the average ratio of travelled distance to geodisic distance
 lMeans = np.mean(lowWPT, axis=0)
@@ -0,0 +1,159 @@
+# Command-line entry point for the model stages, e.g.
+#   python runModel.py find-stops --warehouse DXE1
+#   python runModel.py build-graphs --warehouse DXE1
+#   python runModel.py sample-energy -n 1000 --payload 500 2000 --workers 8 --id run1
+#   python runModel.py cost-sweep --version V1 -n 20 --out figures
+#   python runModel.py plot consumption --id run1 --out figures
+#   python runModel.py pipeline --warehouses UUK2 DXE1 DHA1 -n 1000 --id run1
+# Each subcommand only imports the modules (and heavy libraries) it uses. Figures are drawn
+# with the non-interactive Agg backend unless --show is given, so batch jobs never load a
+# GUI backend; --out saves the figures of a run as PNG files.
+
+import argparse
+import os
+import sys
+import warnings
+import areaDef as ar
+import pipeline
+
+# plots of saved energy data, drawn by the routingV2 plot functions
+plotKinds = ['consumption', 'charge', 'most-efficient', 'wpt-boxplot', 'wpt-change', 'times', 'me-graph']
+
+def makeScenario(args, version, warehouse=None):
+    # builds the run's Scenario from the common options
+    from scenario import Scenario
+    params = {} if args.cost is None else {'cost': args.cost}
+    return Scenario(warehouse or args.warehouse, version, args.expNS, args.expEW, **params)
+
+def findStops(args):
+    import findBusStops as fBS
+    fBS.findLineStops([makeScenario(args, 'V2')])
+
+def buildGraphs(args):
+    import generateGraphs as gG
+    if args.incremental:
+        gG.updateRideGraph(makeScenario(args, 'V2'), args.workers)
+    else:
+        gG.buildGraphs(makeScenario(args, 'V2'), args.workers)
+
+def sampleEnergy(args):
+    import routingV2 as r2
+    scn = makeScenario(args, 'V2')
+    N,E,S,W = scn.bounds
+    payload = args.payload[0] if len(args.payload) == 1 else args.payload[:2]
+    lowWPT, highWPT, nWPT, nBus = r2.getEnergyData(scn, args.n, scn.startLL, [N,S,E,W], payload, args.charge,
+                                                   args.charge2, args.type, args.workers)
+    r2.saveData(lowWPT, highWPT, nWPT, nBus, args.id, scn.warehouse)
+
+def costSweep(args):
+    import numpy as np
+    import routeFuncs as rF
+    scn = makeScenario(args, args.version)
+    N,E,S,W = scn.bounds
+    costs = np.linspace(args.costs[0], args.costs[1], int(args.costs[2]))
+    rF.costParameterPlot(scn.graph('flight'), scn.graph('ride'), scn.startLL, [N,S,E,W], costs, args.n,
+                         scn.busWhkm, scn.flWhkm, scn.sBus, scn.sFly)
+
+def runAll(args):
+    scns = [makeScenario(args, 'V2', warehouse) for warehouse in args.warehouses]
+    payload = args.payload[0] if len(args.payload) == 1 else args.payload[:2]
+    sampleArgs = (args.n, payload, args.charge, args.charge2, args.type, args.workers, args.id)
+    pipeline.runPipeline(scns, args.stages, sampleArgs, args.procs, args.workers, args.incremental)
+
+def plot(args):
+    import routingV2 as r2
+    lowWPT, highWPT, nWPT, nBus = r2.loadData(args.id, args.warehouse)
+    if args.kind == 'consumption':
+        r2.plotConsumption(lowWPT, highWPT, '30W WPT', '100W WPT', nWPT, 'No WPT', nBus, 'Flight Only')
+    elif args.kind == 'charge':
+        r2.plotCharge(lowWPT, highWPT)
+    elif args.kind == 'most-efficient':
+        r2.plotMostEfficient(lowWPT, '30W WPT', highWPT, '100W WPT', nWPT, 'No WPT', nBus, 'Flight Only')
+    elif args.kind == 'wpt-boxplot':
+        r2.plotEnergyConsBP(lowWPT, highWPT, nWPT)
+    elif args.kind == 'wpt-change':
+        r2.plotEnergyConsCh(lowWPT, highWPT, nWPT)
+    elif args.kind == 'times':
+        r2.plotTimes(nWPT, nBus)
+    elif args.kind == 'me-graph':
+        r2.plotMEGraph(highWPT, lowWPT, nWPT, nBus, makeScenario(args, 'V2').graph('flight'))
+
+def parseArgs(argv):
+    # scenario options shared by all subcommands
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--warehouse', default=ar.warehouse, choices=sorted(ar.whCoords))
+    common.add_argument('--exp-ns', dest='expNS', type=float, default=ar.expNS, help='map expansion (m)')
+    common.add_argument('--exp-ew', dest='expEW', type=float, default=ar.expEW, help='map expansion (m)')
+    common.add_argument('--cost', type=float, help='time cost factor (default: per version)')
+    common.add_argument('--show', action='store_true', help='show figures in a GUI window')
+    common.add_argument('--out', help='directory to save figures in')
+
+    parser = argparse.ArgumentParser(description='Bus-drone routing model')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('find-stops', parents=[common], help='save the stops of the bus lines in the area')
+    p.set_defaults(func=findStops)
+
+    p = sub.add_parser('build-graphs', parents=[common], help='build the flight and ride graphs of the area')
+    p.add_argument('--workers', type=int, default=1, help='bus route path worker processes')
+    p.add_argument('--incremental', action='store_true', help='only update the ride graph for changed line files')
+    p.set_defaults(func=buildGraphs)
+
+    # energy sampling options, shared by the sample-energy and pipeline subcommands
+    sampling = argparse.ArgumentParser(add_help=False)
+    sampling.add_argument('-n', type=int, default=1000, help='number of destinations')
+    sampling.add_argument('--payload', type=int, nargs='+', default=[1000], help='payload mass (g), or min and max masses')
+    sampling.add_argument('--charge', default='low', choices=['low', 'high'])
+    sampling.add_argument('--charge2', default='high', choices=['low', 'high'])
+    sampling.add_argument('--type', default='sameDest', choices=['sameDest', 'allNodes', 'random'])
+    sampling.add_argument('--workers', type=int, default=1, help='worker processes per warehouse')
+
+    p = sub.add_parser('sample-energy', parents=[common, sampling], help='route random destinations and save V2 energy data')
+    p.add_argument('--id', required=True, help='id of the saved data files')
+    p.set_defaults(func=sampleEnergy)
+
+    p = sub.add_parser('pipeline', parents=[common, sampling], help='find stops, build graphs and sample energy for several warehouses')
+    p.add_argument('--warehouses', nargs='+', default=sorted(ar.whCoords), choices=sorted(ar.whCoords))
+    p.add_argument('--stages', nargs='+', default=pipeline.stages, choices=pipeline.stages)
+    p.add_argument('--procs', type=int, help='warehouses processed at once (default: all)')
+    p.add_argument('--incremental', action='store_true', help='only update the ride graphs for changed line files')
+    p.add_argument('--id', default='', help='id of the saved data files')
+    p.set_defaults(func=runAll)
+
+    p = sub.add_parser('cost-sweep', parents=[common], help='plot time/energy trade-off against cost factor')
+    p.add_argument('--version', default='V1', choices=['V1', 'V2'])
+    p.add_argument('-n', type=int, default=20, help='number of destinations')
+    p.add_argument('--costs', type=float, nargs=3, default=[1, 30, 91], metavar=('MIN', 'MAX', 'NUM'))
+    p.set_defaults(func=costSweep)
+
+    p = sub.add_parser('plot', parents=[common], help='plot saved V2 energy data')
+    p.add_argument('kind', choices=plotKinds)
+    p.add_argument('--id', required=True, help='id of the saved data files')
+    p.set_defaults(func=plot)
+
+    args = parser.parse_args(argv)
+    if getattr(args, 'type', None) == 'random':
+        args.type = False
+    return args
+
+def saveFigures(outDir, prefix):
+    # saves all open figures as numbered PNG files
+    import matplotlib.pyplot as plt
+    os.makedirs(outDir, exist_ok=True)
+    for i, num in enumerate(plt.get_fignums()):
+        plt.figure(num).savefig(os.path.join(outDir, f"{prefix}_{i}.png"), dpi=200, bbox_inches='tight')
+
+def main(argv=None):
+    args = parseArgs(argv)
+    if not args.show:
+        # selects the non-interactive backend before anything imports pyplot
+        import matplotlib
+        matplotlib.use('Agg')
+        warnings.filterwarnings('ignore', message='.*non-interactive.*')
+    args.func(args)
+    if args.out:
+        name = args.command + ('_' + args.kind if args.command == 'plot' else '')
+        saveFigures(args.out, name)
+
+if __name__ == '__main__':
+    sys.exit(main())
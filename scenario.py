@@ -0,0 +1,91 @@
+# Defines a Scenario: the warehouse, area and drone parameters of one model run, passed
+# explicitly to the routing functions in place of module-level globals.
+# Derived values (area bounds, start point) and the loaded graphs are only computed when
+# first used, so creating a scenario does no work and one process can hold several.
+
+import threading
+from functools import cached_property
+import areaDef as ar
+import routeFuncs as rF
+
+# drone parameters for each framework version: ride/flight energy per km (Wh for V1,
+# relative for V2), bus and drone speeds in km/hr, and the time cost factor for bus use
+droneParams = {
+    'V1': {'busWhkm': 0.72, 'flWhkm': 24, 'sBus': 15, 'sFly': 36, 'cost': rF.costV1},
+    'V2': {'busWhkm': 0.02, 'flWhkm': 1, 'sBus': 15, 'sFly': 43.2, 'cost': rF.costV2},
+}
+
+class Scenario:
+    # warehouse and map expansion (m) define the area; version selects the drone
+    # parameters, any of which can be overridden by keyword
+    def __init__(self, warehouse=ar.warehouse, version='V2', expNS=ar.expNS, expEW=ar.expEW, **params):
+        self.warehouse = warehouse
+        self.version = version
+        self.expNS = expNS
+        self.expEW = expEW
+        drone = dict(droneParams[version])
+        unknown = set(params) - set(drone)
+        if unknown:
+            raise TypeError('Unknown drone parameters: ' + ', '.join(sorted(unknown)))
+        drone.update(params)
+        self.busWhkm = drone['busWhkm']
+        self.flWhkm = drone['flWhkm']
+        self.sBus = drone['sBus']
+        self.sFly = drone['sFly']
+        self.cost = drone['cost']
+        self.graphs = {}
+        self.graphLock = threading.Lock()
+
+    def __repr__(self):
+        return (f"Scenario({self.warehouse!r}, {self.version!r}, expNS={self.expNS}, expEW={self.expEW}, "
+                f"busWhkm={self.busWhkm}, flWhkm={self.flWhkm}, sBus={self.sBus}, sFly={self.sFly}, cost={self.cost})")
+
+    def __getstate__(self):
+        # the lock can't be pickled, e.g. when sent to a spawned worker process
+        state = self.__dict__.copy()
+        del state['graphLock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.graphLock = threading.Lock()
+
+    @property
+    def startEN(self):
+        # warehouse location (eastings, northings)
+        return ar.whCoords[self.warehouse]
+
+    @cached_property
+    def bBoxes(self):
+        # unexpanded and expanded NESW bounds between the warehouse and the furthest delivery point
+        return ar.getBounds(self.startEN, ar.centreEN(), self.expNS, self.expEW)
+
+    @property
+    def bounds(self):
+        # bounding box for delivery locations (N,E,S,W)
+        return self.bBoxes[0]
+
+    @property
+    def routeBounds(self):
+        # bounding box for routes (N,E,S,W)
+        return self.bBoxes[1]
+
+    @cached_property
+    def startLL(self):
+        # start location (lat, lon)
+        return ar.EN2LL(self.startEN)
+
+    def graph(self, fName):
+        # returns the scenario's 'flight' or 'ride' graph, loading it on first use
+        # only the ride graph is loaded: the flight graph is its flight layer, sharing
+        # its nodes and edges. V1 routes apply the cost factor in the search weight,
+        # V2 routes use the graph's costed 'cost' attribute
+        with self.graphLock:
+            if 'ride' not in self.graphs:
+                for name in ('ride', 'flight'):
+                    if self.version == 'V1':
+                        self.graphs[name] = rF.loadGraph(name, self.busWhkm, self.flWhkm, self.warehouse)
+                    else:
+                        self.graphs[name] = rF.loadCostedGraph(name, self.busWhkm, self.flWhkm, self.cost,
+                                                               self.warehouse)
+            return self.graphs[fName]
@@ -0,0 +1,67 @@
+# Defines a cached spatial index for snapping points to their nearest graph nodes.
+# A KD-tree is built once per graph over the nodes' positions on the unit sphere, where
+# straight-line distance orders points the same as geodesic distance, so arrays of
+# lat/lon points are snapped in a single query with the same result as ox.nearest_nodes.
+# Snap distances are returned with the nodes, so large snaps can be flagged.
+# Graphs loaded from saved arrays (graphStore.StoredGraph) are indexed from the arrays.
+
+import threading
+import weakref
+import numpy as np
+from scipy.spatial import cKDTree
+import graphStore as gS
+
+earthRadius = 6371009       # mean earth radius in m, as used by osmnx
+maxSnap = 170               # snap distance (m) above which a point is treated as off the network
+
+# KD-tree, node ids and coordinates per graph; weak keys drop the entries when a graph is discarded
+indexCache = weakref.WeakKeyDictionary()
+indexLock = threading.Lock()
+
+def unitSphere(lats, lons):
+    # converts lat/lon arrays in degrees to (n, 3) points on the unit sphere
+    lats, lons = np.radians(lats), np.radians(lons)
+    return np.column_stack((np.cos(lats)*np.cos(lons), np.cos(lats)*np.sin(lons), np.sin(lats)))
+
+def getIndex(graph):
+    # returns the index of a graph, building it on first use: its KD-tree, node ids, node
+    # lats and lons, and the order sorting the node ids (for looking up nodes' coordinates)
+    # flight layer views (see routeEngine.flightLayer) share their ride graph's index
+    if graph.graph.get('layer') == 'flight':
+        graph = graph._graph
+    with indexLock:
+        index = indexCache.get(graph)
+    if index is None:
+        if isinstance(graph, gS.StoredGraph):
+            nodes = np.asarray(graph.arrays['nodeIds'])
+            xs, ys = np.asarray(graph.arrays['nodeX']), np.asarray(graph.arrays['nodeY'])
+        else:
+            nodes, xs, ys = map(np.array, zip(*((n, d['x'], d['y']) for n, d in graph.nodes(data=True))))
+        index = {'tree': cKDTree(unitSphere(ys, xs)), 'nodes': nodes, 'lats': ys, 'lons': xs,
+                 'order': np.argsort(nodes)}
+        with indexLock:
+            index = indexCache.setdefault(graph, index)
+    return index
+
+def nodeCoords(graph, nodes=None):
+    # returns the (lats, lons) arrays of a graph's nodes, or of all its nodes
+    index = getIndex(graph)
+    if nodes is None:
+        return index['lats'], index['lons']
+    order = index['order']
+    inds = order[np.searchsorted(index['nodes'], nodes, sorter=order)]
+    return index['lats'][inds], index['lons'][inds]
+
+def snapNodes(graph, points):
+    # snaps an (n, 2) array of lat/lon points to their nearest graph nodes,
+    # returning the node ids and the geodesic snap distances in m
+    points = np.atleast_2d(np.asarray(points, dtype=float))
+    index = getIndex(graph)
+    chord, inds = index['tree'].query(unitSphere(points[:, 0], points[:, 1]))
+    dists = 2*earthRadius*np.arcsin(np.minimum(chord/2, 1))
+    return index['nodes'][inds], dists
+
+def snapNode(graph, point):
+    # snaps a single (lat, lon) point to its nearest graph node
+    nodes, _ = snapNodes(graph, [point])
+    return nodes[:1].tolist()[0]